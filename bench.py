@@ -0,0 +1,437 @@
+# bench.py
+"""
+Small benchmarks for the PoC. Run e.g.
+
+    python bench.py ledger-writers --workers 1 2 4 8 --appends 500
+    python bench.py ledger-backends --entries 5000
+    python bench.py ledger-hashing --entries 100000
+    python bench.py db-pool --threads 8 --ops 2000
+    python bench.py schema-indexes --tests 1000000
+    python bench.py bulk-insert --rows 50000 100000
+    python bench.py segmenters --mb 100
+    python bench.py search --rows 1000000
+    python bench.py near-dups --rows 100000
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+import db
+import ingest
+import migrations
+import neardup
+import search
+from ledger import HASH_SCHEMES, Ledger, _entry_hash, canonical_payload
+from ledger_file import FileLedger
+
+
+def _check_linear(db_path):
+    conn = sqlite3.connect(db_path)
+    prev, expected_idx, n = "", 1, 0
+    for idx, prev_hash, h in conn.execute("SELECT idx, prev_hash, hash FROM ledger ORDER BY idx"):
+        if idx != expected_idx or prev_hash != prev:
+            conn.close()
+            return False, n
+        prev, expected_idx, n = h, idx + 1, n + 1
+    conn.close()
+    return True, n
+
+
+def _writer_proc(db_path, appends, start):
+    ledger = Ledger(db_path)
+    start.wait()
+    for i in range(appends):
+        ledger.append(json.dumps({"action": "bench", "pid": os.getpid(), "i": i}))
+
+
+def bench_ledger_writers(args):
+    print(f"{'workers':>8} {'appends':>8} {'seconds':>8} {'appends/s':>10} linear")
+    for workers in args.workers:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "bench.db")
+            Ledger(db_path)
+            start = multiprocessing.Event()
+            procs = [multiprocessing.Process(target=_writer_proc, args=(db_path, args.appends, start))
+                     for _ in range(workers)]
+            for p in procs:
+                p.start()
+            t0 = time.perf_counter()
+            start.set()
+            for p in procs:
+                p.join()
+            elapsed = time.perf_counter() - t0
+            linear, n = _check_linear(db_path)
+            print(f"{workers:>8} {n:>8} {elapsed:>8.2f} {n / elapsed:>10.0f} {linear}")
+
+
+def bench_ledger_backends(args):
+    payloads = [json.dumps({"action": "bench", "project_id": i % 10, "i": i}) for i in range(args.entries)]
+    print(f"{'backend':>16} {'append/s':>10} {'batch64/s':>10} {'read_latest ms':>15}")
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = [("sqlite", lambda n: Ledger(os.path.join(tmp, f"{n}.db"), merkle_epoch=0))]
+        backends += [(f"file/{policy}", lambda n, policy=policy: FileLedger(os.path.join(tmp, f"{n}.log"), fsync=policy))
+                     for policy in ("record", "batch", "interval")]
+        for name, make in backends:
+            ledger = make(name.replace("/", "-") + "-single")
+            t0 = time.perf_counter()
+            for p in payloads:
+                ledger.append(p)
+            single = len(payloads) / (time.perf_counter() - t0)
+            ledger.close()
+
+            ledger = make(name.replace("/", "-") + "-batch")
+            t0 = time.perf_counter()
+            for i in range(0, len(payloads), 64):
+                ledger.append_many(payloads[i:i + 64])
+            batched = len(payloads) / (time.perf_counter() - t0)
+
+            t0 = time.perf_counter()
+            for i in range(100):
+                ledger.read_latest(limit=50, project_id=i % 10)
+            read_ms = (time.perf_counter() - t0) * 1000 / 100
+            ledger.close()
+            print(f"{name:>16} {single:>10.0f} {batched:>10.0f} {read_ms:>15.2f}")
+
+
+def bench_ledger_hashing(args):
+    events = [{"action": "approve_test", "project_id": i % 50, "test_id": i, "approver": "qa"} for i in range(args.entries)]
+    prev = "0" * 64
+    ts = time.time()
+    print(f"{'step':>28} {'us/entry':>9}")
+
+    def report(name, fn):
+        t0 = time.perf_counter()
+        out = [fn(e) for e in events]
+        print(f"{name:>28} {(time.perf_counter() - t0) * 1e6 / len(events):>9.2f}")
+        return out
+
+    report("encode json.dumps", json.dumps)
+    report("encode canonical", canonical_payload)
+    for scheme, (name, _) in HASH_SCHEMES.items():
+        report(f"hash {name}", lambda p, scheme=scheme: _entry_hash(ts, p, prev, scheme))
+    for scheme, (name, _) in HASH_SCHEMES.items():
+        report(f"canonical + {name}", lambda e, scheme=scheme: _entry_hash(ts, canonical_payload(e), prev, scheme))
+
+
+def _percentile(samples, q):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * q))]
+
+
+def bench_db_pool(args):
+    """Mixed reads/writes from a thread pool: connect-per-request (the old main.py) vs the shared WAL pool."""
+    schema = "CREATE TABLE IF NOT EXISTS requirements (id INTEGER PRIMARY KEY AUTOINCREMENT, project_id INTEGER, text TEXT)"
+    print(f"{'mode':>8} {'ops/s':>8} {'read p50':>9} {'read p99':>9} {'write p50':>10} {'write p99':>10}  (ms)")
+    with tempfile.TemporaryDirectory() as tmp:
+        for mode in ("connect", "pool"):
+            db_path = os.path.join(tmp, f"{mode}.db")
+            pool = db.ConnectionPool()
+            if mode == "connect":
+                @contextmanager
+                def connect():
+                    conn = sqlite3.connect(db_path, timeout=30)
+                    try:
+                        yield conn
+                    finally:
+                        conn.close()
+            else:
+                @contextmanager
+                def connect():
+                    with pool.connect(db_path) as conn:
+                        yield conn
+            with connect() as conn:
+                conn.execute(schema)
+                conn.executemany("INSERT INTO requirements (project_id, text) VALUES (?, ?)",
+                                 [(i % 50, f"requirement {i}") for i in range(args.rows)])
+                conn.commit()
+
+            reads, writes = [], []
+            samples_lock = threading.Lock()
+
+            def worker(seed):
+                rnd = random.Random(seed)
+                r, w = [], []
+                for _ in range(args.ops):
+                    t0 = time.perf_counter()
+                    with connect() as conn:
+                        if rnd.random() < args.write_ratio:
+                            conn.execute("INSERT INTO requirements (project_id, text) VALUES (?, ?)", (rnd.randrange(50), "new"))
+                            conn.commit()
+                            w.append(time.perf_counter() - t0)
+                        else:
+                            conn.execute("SELECT id, text FROM requirements WHERE project_id = ? ORDER BY id DESC LIMIT 50",
+                                         (rnd.randrange(50),)).fetchall()
+                            r.append(time.perf_counter() - t0)
+                with samples_lock:
+                    reads.extend(r)
+                    writes.extend(w)
+
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(args.threads)]
+            t0 = time.perf_counter()
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            elapsed = time.perf_counter() - t0
+            pool.close_all()
+            ms = lambda xs, q: _percentile(xs, q) * 1000 if xs else float("nan")
+            print(f"{mode:>8} {(len(reads) + len(writes)) / elapsed:>8.0f} {ms(reads, .5):>9.2f} {ms(reads, .99):>9.2f} "
+                  f"{ms(writes, .5):>10.2f} {ms(writes, .99):>10.2f}")
+
+
+def bench_schema_indexes(args):
+    """Hot queries of main.py on an unindexed (version 1) schema, then after migrating to the latest version."""
+    n_reqs = args.tests // 3
+    queries = [
+        ("get_tests", "SELECT id, requirement_id, title, steps, compliance_justification, risk_score "
+                      "FROM test_cases WHERE project_id = ?", lambda r: (r.randrange(args.projects),)),
+        ("generate reqs", "SELECT id, text FROM requirements WHERE project_id = ?", lambda r: (r.randrange(args.projects),)),
+        ("tests of req", "SELECT id FROM test_cases WHERE requirement_id = ?", lambda r: (r.randrange(1, n_reqs + 1),)),
+        ("riskiest 10", "SELECT id FROM test_cases WHERE project_id = ? ORDER BY risk_score DESC LIMIT 10",
+                        lambda r: (r.randrange(args.projects),)),
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = sqlite3.connect(os.path.join(tmp, "schema.db"))
+        migrations.migrate(conn, target=1)
+        rnd = random.Random(0)
+        conn.executemany("INSERT INTO projects (id, name, region, regulations) VALUES (?, ?, 'EU', '[]')",
+                         [(p, f"p{p}") for p in range(args.projects)])
+        conn.executemany("INSERT INTO requirements (id, project_id, text) VALUES (?, ?, ?)",
+                         [(i, i % args.projects, f"requirement {i}") for i in range(1, n_reqs + 1)])
+        conn.executemany("""INSERT INTO test_cases (project_id, requirement_id, title, steps, compliance_justification, risk_score)
+                            VALUES (?, ?, 't', '[]', '{}', ?)""",
+                         ((r % args.projects, r, rnd.random()) for r in (rnd.randrange(1, n_reqs + 1) for _ in range(args.tests))))
+        conn.commit()
+
+        def run(label):
+            for name, sql, params in queries:
+                r = random.Random(1)
+                samples = []
+                for _ in range(args.queries):
+                    t0 = time.perf_counter()
+                    conn.execute(sql, params(r)).fetchall()
+                    samples.append(time.perf_counter() - t0)
+                print(f"{label:>8} {name:>14} {_percentile(samples, .5) * 1000:>9.2f} {_percentile(samples, .99) * 1000:>9.2f}")
+
+        print(f"{'schema':>8} {'query':>14} {'p50 ms':>9} {'p99 ms':>9}")
+        run("v1")
+        t0 = time.perf_counter()
+        version = migrations.migrate(conn)
+        print(f"migrated to v{version} in {time.perf_counter() - t0:.1f}s")
+        run(f"v{version}")
+        conn.close()
+
+
+def bench_bulk_insert(args):
+    """Row-at-a-time execute() + lastrowid (the old ingest/generate loops) vs db.insert_many()."""
+    sql = """INSERT INTO test_cases (project_id, requirement_id, title, steps, compliance_justification, risk_score)
+             VALUES (?, ?, ?, ?, ?, ?)"""
+    print(f"{'rows':>8} {'loop s':>8} {'batch s':>8} {'same ids':>9}")
+    for n in args.rows:
+        rows = [(1, i, f"test {i}", '["step"]', '{"regulation": "GDPR"}', 0.5) for i in range(n)]
+        ids, times = [], []
+        with tempfile.TemporaryDirectory() as tmp:
+            for mode in ("loop", "batch"):
+                pool = db.ConnectionPool()
+                path = os.path.join(tmp, f"{mode}.db")
+                with pool.connect(path) as conn:
+                    migrations.migrate(conn, target=2)
+                    cur = conn.cursor()
+                    t0 = time.perf_counter()
+                    if mode == "loop":
+                        out = []
+                        for r in rows:
+                            cur.execute(sql, r)
+                            out.append(cur.lastrowid)
+                    else:
+                        out = db.insert_many(cur, sql, rows)
+                    conn.commit()
+                    times.append(time.perf_counter() - t0)
+                    ids.append(out)
+                pool.close_all()
+        print(f"{n:>8} {times[0]:>8.2f} {times[1]:>8.2f} {str(ids[0] == ids[1]):>9}")
+
+
+def _synthetic_spec(mb, seed=0):
+    """A numbered Markdown spec of roughly `mb` MB: chapters, numbered sections, REQ-n requirements of a few sentences."""
+    rnd = random.Random(seed)
+    words = ("system user data record audit access encrypted retained logged session patient report "
+             "administrator backup shall must within minutes days records event review").split()
+    parts, size, n = [], 0, 0
+    while size < mb * 1e6:
+        chapter = len(parts) + 1
+        parts.append(f"# {chapter} Chapter {chapter}\n\n")
+        for sec in range(1, 6):
+            parts.append(f"{chapter}.{sec} Section {sec}\n")
+            for _ in range(20):
+                n += 1
+                sentence = " ".join(rnd.choice(words) for _ in range(rnd.randrange(25, 45)))
+                parts.append(f"REQ-{n:06d}: The {sentence}.\nThe {sentence[::-1]}.\n\n")
+        size += sum(len(p) for p in parts[-106:])
+    return "".join(parts).encode()
+
+
+def bench_segmenters(args):
+    data = _synthetic_spec(args.mb)
+    print(f"{'segmenter':>12} {'segments':>9} {'MB/s':>8}")
+    for name in sorted(ingest.SEGMENTERS):
+        seg = ingest.make_segmenter(name)
+        t0 = time.perf_counter()
+        n = 0
+        for i in range(0, len(data), ingest.READ_CHUNK):
+            n += len(list(seg.feed(data[i:i + ingest.READ_CHUNK])))
+        n += len(list(seg.close()))
+        print(f"{name:>12} {n:>9} {len(data) / 1e6 / (time.perf_counter() - t0):>8.1f}")
+
+
+def bench_search(args):
+    """Project-scoped FTS5 search latency (the /search endpoint's queries) on one large project."""
+    rnd = random.Random(0)
+    vocab = [f"w{i}" for i in range(5000)] + "encrypt audit retain access session backup consent".split()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "search.db")
+        with db.connect(path) as conn:
+            migrations.migrate(conn)
+            conn.executemany("INSERT INTO projects (id, name) VALUES (?, ?)", [(1, "big"), (2, "other")])
+            t0 = time.perf_counter()
+            for i in range(0, args.rows, 50000):
+                conn.executemany("INSERT INTO requirements (project_id, text, content_hash) VALUES (?, ?, ?)",
+                                 [(1 + (j % 10 == 0), " ".join(rnd.choice(vocab) for _ in range(30)), f"h{j}")
+                                  for j in range(i, min(i + 50000, args.rows))])
+                conn.commit()
+            print(f"indexed {args.rows} requirements in {time.perf_counter() - t0:.1f}s")
+        print(f"{'query':>20} {'p50 ms':>8} {'p99 ms':>8} {'hits':>5}")
+        for q in ("encrypt", "encrypt audit", "w42 w4242", "acc*", "nosuchword"):
+            samples = []
+            with db.connect(path) as conn:
+                for _ in range(args.queries):
+                    t0 = time.perf_counter()
+                    hits = search.search(conn, 1, q, kind="requirement", limit=20)
+                    samples.append(time.perf_counter() - t0)
+            print(f"{q:>20} {_percentile(samples, .5) * 1000:>8.2f} {_percentile(samples, .99) * 1000:>8.2f} {len(hits):>5}")
+
+
+def bench_near_dups(args):
+    """
+    Ingest-time clustering (neardup.assign_clusters, in INGEST_BATCH-sized
+    transactions) of synthetic requirements, `--dup-rate` of which restate
+    an earlier one with one word replaced or added. Reports throughput and
+    how many restatements landed in their original's cluster.
+    """
+    rnd = random.Random(0)
+    vocab = ["".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randrange(3, 10))) for _ in range(5000)]
+    texts, origin = [], {}  # origin: index of a restatement -> index of the requirement it restates
+    for i in range(args.rows):
+        if texts and rnd.random() < args.dup_rate:
+            j = rnd.randrange(len(texts))
+            words = texts[j].split()
+            k = rnd.randrange(len(words))
+            if rnd.random() < .5:
+                words[k] = rnd.choice(vocab)
+            else:
+                words.insert(k, rnd.choice(vocab))
+            origin[i] = origin.get(j, j)
+            texts.append(" ".join(words))
+        else:
+            texts.append("The system shall " + " ".join(rnd.choice(vocab) for _ in range(rnd.randrange(10, 30))) + ".")
+    sample = texts[:2000]
+    for name, np in (("numpy", neardup.np), ("python", None)):
+        if name == "numpy" and np is None:
+            continue
+        saved, neardup.np = neardup.np, np
+        t0 = time.perf_counter()
+        for t in sample:
+            neardup.signature(t)
+        neardup.np = saved
+        print(f"signature ({name}): {len(sample) / (time.perf_counter() - t0):,.0f} requirements/s")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "neardup.db")
+        with db.connect(path) as conn:
+            migrations.migrate(conn)
+            conn.execute("INSERT INTO projects (id, name) VALUES (1, 'big')")
+            conn.commit()
+            cur = conn.cursor()
+            ids, spent = [], 0.0
+            for i in range(0, len(texts), args.batch):
+                part = texts[i:i + args.batch]
+                cur.execute("BEGIN IMMEDIATE")
+                new = db.insert_many(cur, "INSERT INTO requirements (project_id, text, content_hash) VALUES (1, ?, ?)",
+                                     [(t, f"h{i + j}") for j, t in enumerate(part)])
+                t0 = time.perf_counter()
+                neardup.assign_clusters(cur, 1, list(zip(new, part)), args.threshold)
+                conn.commit()
+                spent += time.perf_counter() - t0
+                ids += new
+            cluster = dict(conn.execute("SELECT id, cluster_id FROM requirements"))
+            found, total = neardup.clusters(conn, 1, min_size=2, limit=1)
+        found_dups = sum(cluster[ids[i]] == cluster[ids[j]] for i, j in origin.items())
+        false = sum(1 for i in range(len(ids)) if i not in origin and cluster[ids[i]] != ids[i])
+        print(f"clustered {len(texts)} requirements in {spent:.1f}s ({len(texts) / spent:,.0f}/s, "
+              f"batches of {args.batch}), {total} clusters of 2+")
+        print(f"restatements in their original's cluster: {found_dups}/{len(origin)} "
+              f"({found_dups / max(len(origin), 1):.1%}); unrelated requirements clustered: {false}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Equilix PoC benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+
+    p = sub.add_parser("ledger-writers", help="concurrent cross-process Ledger.append throughput")
+    p.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    p.add_argument("--appends", type=int, default=500, help="appends per worker")
+    p.set_defaults(func=bench_ledger_writers)
+
+    p = sub.add_parser("ledger-backends", help="SQLite vs append-only file ledger backends")
+    p.add_argument("--entries", type=int, default=5000)
+    p.set_defaults(func=bench_ledger_backends)
+
+    p = sub.add_parser("ledger-hashing", help="per-entry payload encoding and hashing cost")
+    p.add_argument("--entries", type=int, default=100000)
+    p.set_defaults(func=bench_ledger_hashing)
+
+    p = sub.add_parser("db-pool", help="per-request sqlite3.connect vs the shared WAL connection pool")
+    p.add_argument("--threads", type=int, default=8)
+    p.add_argument("--ops", type=int, default=2000, help="operations per thread")
+    p.add_argument("--rows", type=int, default=20000, help="rows preloaded before the run")
+    p.add_argument("--write-ratio", type=float, default=0.2)
+    p.set_defaults(func=bench_db_pool)
+
+    p = sub.add_parser("schema-indexes", help="query latency before/after the index migrations")
+    p.add_argument("--tests", type=int, default=1000000, help="test_cases rows")
+    p.add_argument("--projects", type=int, default=200)
+    p.add_argument("--queries", type=int, default=50, help="queries per kind")
+    p.set_defaults(func=bench_schema_indexes)
+
+    p = sub.add_parser("bulk-insert", help="per-row inserts vs executemany for ingest/generate")
+    p.add_argument("--rows", type=int, nargs="+", default=[50000, 100000])
+    p.set_defaults(func=bench_bulk_insert)
+
+    p = sub.add_parser("segmenters", help="requirement segmenter throughput on a synthetic spec")
+    p.add_argument("--mb", type=float, default=100)
+    p.set_defaults(func=bench_segmenters)
+
+    p = sub.add_parser("search", help="full-text search latency on a large project")
+    p.add_argument("--rows", type=int, default=1000000, help="requirements (90%% in the searched project)")
+    p.add_argument("--queries", type=int, default=50, help="runs per query")
+    p.set_defaults(func=bench_search)
+
+    p = sub.add_parser("near-dups", help="MinHash/LSH near-duplicate clustering at ingest")
+    p.add_argument("--rows", type=int, default=100000)
+    p.add_argument("--dup-rate", type=float, default=0.1, help="fraction of requirements that restate an earlier one")
+    p.add_argument("--batch", type=int, default=1000, help="requirements per ingest transaction")
+    p.add_argument("--threshold", type=float, default=neardup.THRESHOLD)
+    p.set_defaults(func=bench_near_dups)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
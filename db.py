@@ -0,0 +1,150 @@
+# db.py
+"""
+Shared SQLite connection pool used by main.py and ledger.py.
+
+Each thread keeps one open connection per database file instead of paying
+sqlite3.connect() on every request. Connections are opened in WAL mode
+(readers no longer wait behind writers) with synchronous=NORMAL, which in
+WAL mode is still crash-safe; only the last commits can be lost on power
+failure. mmap and a larger page cache cut read syscalls. Foreign keys are
+enforced. Writes that must survive power loss (the ledger) pass
+synchronous="FULL" to connect() for the duration of the block.
+
+    with db.connect(DB_PATH) as conn:
+        conn.execute(...)
+        conn.commit()
+
+Leaving the block never closes the connection. Any transaction still open
+is rolled back, so the next user on this thread starts clean. A thread's
+connections are closed when the thread exits (threadpool workers come and
+go), or by close_all() at shutdown.
+"""
+import os
+import sqlite3
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+
+class ConnectionPool:
+    def __init__(self, busy_timeout=5.0, synchronous="NORMAL", mmap_size=256 * 1024 * 1024, cache_kib=16384):
+        self.busy_timeout = busy_timeout
+        self.synchronous = synchronous
+        self.mmap_size = mmap_size
+        self.cache_kib = cache_kib
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._all = weakref.WeakSet()  # each live thread's connections, for close_all()
+        self._stats = {"opened": 0, "reused": 0, "rolled_back": 0, "closed": 0, "open_seconds": 0.0}
+
+    def _configure(self, conn):
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={self.synchronous}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_kib)}")
+        conn.execute("PRAGMA foreign_keys=ON")
+
+    def _open(self, path):
+        t0 = time.perf_counter()
+        # Only ever used by the thread that opened it; check_same_thread is off
+        # so close_all() can close it from elsewhere.
+        conn = sqlite3.connect(path, timeout=self.busy_timeout, check_same_thread=False)
+        self._configure(conn)
+        with self._lock:
+            self._stats["opened"] += 1
+            self._stats["open_seconds"] += time.perf_counter() - t0
+        return conn
+
+    def dedicated(self, path):
+        """A new connection with the pool's pragmas that the caller owns and closes."""
+        conn = sqlite3.connect(path, timeout=self.busy_timeout, check_same_thread=False)
+        self._configure(conn)
+        return conn
+
+    def connection(self, path):
+        """This thread's connection to `path`, opened on first use."""
+        if os.getpid() != self._pid:
+            # Forked child: the parent's connections must not be used here.
+            self._local, self._all, self._pid = threading.local(), weakref.WeakSet(), os.getpid()
+        holder = getattr(self._local, "holder", None)
+        if holder is None:
+            # Only the thread-local references the holder, so it is collected
+            # (and its connections closed) when the thread exits.
+            holder = self._local.holder = _ThreadConnections()
+            weakref.finalize(holder, self._close_thread, holder.conns, self._pid)
+            with self._lock:
+                self._all.add(holder)
+        conns = holder.conns
+        conn = conns.get(path)
+        if conn is None:
+            conn = conns[path] = self._open(path)
+        else:
+            with self._lock:
+                self._stats["reused"] += 1
+        return conn
+
+    @contextmanager
+    def connect(self, path, synchronous=None):
+        conn = self.connection(path)
+        override = synchronous is not None and synchronous.upper() != self.synchronous.upper()
+        if override:
+            conn.execute(f"PRAGMA synchronous={synchronous}")
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+                with self._lock:
+                    self._stats["rolled_back"] += 1
+            if override:
+                conn.execute(f"PRAGMA synchronous={self.synchronous}")
+
+    def _close_thread(self, conns, pid):
+        if os.getpid() != pid:
+            return  # inherited by a forked child: the parent still uses them
+        for conn in conns.values():
+            conn.close()
+        with self._lock:
+            self._stats["closed"] += len(conns)
+        conns.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, open_connections=sum(len(h.conns) for h in self._all))
+
+    def close_all(self):
+        """Close every pooled connection (at shutdown; threads must not use them afterwards)."""
+        with self._lock:
+            holders, self._all = list(self._all), weakref.WeakSet()
+        for holder in holders:
+            self._close_thread(holder.conns, self._pid)
+        self._local = threading.local()
+
+
+class _ThreadConnections:
+    """One thread's connections by path (a weakref-able holder for the thread-local)."""
+    def __init__(self):
+        self.conns = {}
+
+
+def insert_many(cur, sql, rows):
+    """
+    executemany() an INSERT into an AUTOINCREMENT table and return the new
+    ids in row order, like collecting cur.lastrowid after each execute().
+    The statement runs inside one write transaction, so no other connection
+    can insert in between and the ids are the consecutive run ending at
+    last_insert_rowid(). Must not be mixed with other inserts into the same
+    table within the call.
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    cur.executemany(sql, rows)
+    last = cur.execute("SELECT last_insert_rowid()").fetchone()[0]
+    return list(range(last - len(rows) + 1, last + 1))
+
+
+pool = ConnectionPool()
+connect = pool.connect
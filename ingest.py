@@ -0,0 +1,361 @@
+# ingest.py
+"""
+Streaming helpers for requirement ingestion: uploads are read in chunks and
+split into segments (requirements) incrementally, so memory depends on the
+longest segment rather than on the size of the document.
+
+Segmenters share one interface: feed(text or bytes) and close() yield
+Segment(text, spec_ref, section_path); split(text) does both. SEGMENTERS
+maps the names accepted by the ingest endpoints to their classes.
+"""
+import codecs
+import difflib
+import hashlib
+import re
+import tarfile
+import threading
+import zipfile
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+READ_CHUNK = 1 << 20  # bytes per UploadFile.read()
+MAX_MEMBER_BYTES = 256 << 20  # decompressed size limit per document (archive bombs)
+# Limits across one parse_documents() call, so many documents or members
+# under MAX_MEMBER_BYTES each cannot add up to an unbounded request.
+MAX_TOTAL_BYTES = 1 << 30  # decompressed bytes
+MAX_SEGMENTS = 200000
+MAX_MEMBERS = 10000  # documents and archive members, skipped ones included
+TEXT_SUFFIXES = (".txt", ".text", ".md", ".markdown", ".rst")  # archive members that are parsed
+TAR_SUFFIXES = (".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+_WS = re.compile(r"\s+")
+
+# spec_ref: the requirement's own ID or number ("REQ-001", "3.2.1"), if any.
+# section_path: enclosing headings joined with " > ", if any.
+Segment = namedtuple("Segment", "text spec_ref section_path")
+
+
+def normalize(text):
+    return _WS.sub(" ", text).strip().casefold()
+
+
+def content_hash(text):
+    """
+    sha256 of the requirement with case and whitespace normalized, so a
+    re-uploaded spec with different line wrapping still matches.
+    """
+    return hashlib.sha256(normalize(text).encode("utf-8")).hexdigest()
+
+
+def diff_requirements(stored, paragraphs, threshold=0.8, max_pairs=250000):
+    """
+    Diff a new version of a spec against a project's stored requirements.
+
+    stored: [(requirement_id, content_hash, text)] currently active.
+    paragraphs: the new version's paragraphs, in order.
+
+    Paragraphs with a stored hash are unchanged. The rest are paired with
+    unmatched stored requirements by difflib similarity (best match first
+    come, at least `threshold`) and reported as modified; what is left is
+    added or removed. Fuzzy matching is skipped when it would take more
+    than `max_pairs` comparisons (e.g. an unrelated document).
+
+    Returns {"unchanged": [id], "added": [text], "removed": [id],
+    "modified": [(old_id, text, similarity)]}.
+    """
+    by_hash = {h: rid for rid, h, _ in stored}
+    unchanged, added, seen = [], [], set()
+    for t in paragraphs:
+        h = content_hash(t)
+        if h in seen:
+            continue
+        seen.add(h)
+        if h in by_hash:
+            unchanged.append(by_hash[h])
+        else:
+            added.append(t)
+    matched = set(unchanged)
+    gone = {rid: normalize(text) for rid, _, text in stored if rid not in matched}
+    modified = []
+    if gone and added and len(gone) * len(added) <= max_pairs:
+        unpaired = []
+        for t in added:
+            sm = difflib.SequenceMatcher(None, autojunk=False)
+            sm.set_seq2(normalize(t))  # seq2 is the side SequenceMatcher caches
+            best = None
+            for rid, old in gone.items():
+                sm.set_seq1(old)
+                if sm.real_quick_ratio() < threshold or sm.quick_ratio() < threshold:
+                    continue
+                r = sm.ratio()
+                if r >= threshold and (best is None or r > best[1]):
+                    best = (rid, r)
+            if best:
+                modified.append((best[0], t, round(best[1], 3)))
+                del gone[best[0]]
+            else:
+                unpaired.append(t)
+        added = unpaired
+    return {"unchanged": unchanged, "added": added, "removed": list(gone), "modified": modified}
+
+
+class _Segmenter:
+    def __init__(self, encoding="utf-8"):
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+
+    def _decode(self, data):
+        return self._decoder.decode(data) if isinstance(data, bytes) else data
+
+    def split(self, text):
+        """Segment a whole string at once."""
+        yield from self.feed(text)
+        yield from self.close()
+
+
+class ParagraphSplitter(_Segmenter):
+    """
+    Blank-line separated paragraphs, fed in arbitrary chunks: the same
+    texts as `[p.strip() for p in text.split("\n\n") if p.strip()]`,
+    including separators and multi-byte characters that straddle chunk
+    boundaries. Undecodable bytes become U+FFFD.
+    """
+    def __init__(self, encoding="utf-8"):
+        super().__init__(encoding)
+        self._buf = ""
+
+    def feed(self, data):
+        data = self._decode(data)
+        self._buf += data
+        if "\n\n" not in data and "\n" not in data[:1]:
+            return  # no new separator can be complete
+        *done, self._buf = self._buf.split("\n\n")
+        for p in done:
+            p = p.strip()
+            if p:
+                yield Segment(p, None, None)
+
+    def close(self):
+        tail, self._buf = self._buf + self._decoder.decode(b"", final=True), ""
+        for p in tail.split("\n\n"):
+            p = p.strip()
+            if p:
+                yield Segment(p, None, None)
+
+
+class StructuredSegmenter(_Segmenter):
+    """
+    Numbered specs and Markdown. A segment ends at a blank line or where a
+    line starts with a Markdown heading ("## Access control"), a
+    requirement ID ("REQ-001", "SEC-12: ...") or a dotted number ("3.2.1",
+    "4."). Headings, and numbered lines that read like titles (short, no
+    closing punctuation, no "shall"/"must"/...), are not requirements: they
+    set the section path of what follows. IDs and
+    numbers become the segment's spec_ref.
+
+    Boundaries are found by one compiled regex that starts with a literal
+    newline, so the scan runs at memchr speed between lines; Python code
+    only runs once per segment.
+    """
+    _BOUNDARY = re.compile(r"\n(?:[ \t]*\n)+|\n(?=[ \t]*(?:#{1,6}[ \t]|[A-Z][A-Z0-9]{1,9}-\d+\b|\d+(?:\.\d+)+\.?[ \t]|\d+\.[ \t]))")
+    _HEADING = re.compile(r"(#{1,6})[ \t]+([^\n]*)\n?(.*)", re.S)
+    _ID = re.compile(r"([A-Z][A-Z0-9]{1,9}-\d+)\b")
+    _NUMBER = re.compile(r"(\d+(?:\.\d+)+\.?|\d+\.)[ \t]+([^\n]*)\n?(.*)", re.S)
+    _NORMATIVE = re.compile(r"\b(?:shall|must|should|required|will|may not)\b", re.I)
+    max_title = 80  # longer numbered lines are requirements, not headings
+
+    def __init__(self, encoding="utf-8"):
+        super().__init__(encoding)
+        self._buf = ""
+        self._sections = []  # [(level, title)]
+        self._path = None
+
+    def feed(self, data):
+        self._buf += self._decode(data)
+        last_nl = self._buf.rfind("\n")
+        if last_nl < 0:
+            return []
+        # Cut only before the last newline: every line a boundary lookahead
+        # (or a run of blank lines) can reach is then complete. The last
+        # piece may continue in the next chunk, so it is held back.
+        *pieces, rest = self._BOUNDARY.split(self._buf[:last_nl])
+        self._buf = rest + self._buf[last_nl:]
+        segment = self._segment
+        return [seg for seg in map(segment, pieces) if seg]
+
+    def close(self):
+        tail, self._buf = self._buf + self._decoder.decode(b"", final=True), ""
+        return [seg for seg in map(self._segment, self._BOUNDARY.split(tail)) if seg]
+
+    def _enter(self, level, title):
+        while self._sections and self._sections[-1][0] >= level:
+            self._sections.pop()
+        self._sections.append((level, title))
+        self._path = " > ".join(t for _, t in self._sections)
+
+    def _segment(self, text):
+        """The Segment for one chunk of text between boundaries, or None for a bare heading."""
+        text = text.strip()
+        if not text:
+            return None
+        c = text[0]  # dispatch on the first character: one regex per segment at most
+        if c == "#":
+            m = self._HEADING.match(text)
+            if m:
+                self._enter(len(m.group(1)), m.group(2).strip().rstrip("#").strip())
+                text = m.group(3).strip()
+                if not text:
+                    return None
+                c = text[0]
+        if c.isdigit():
+            m = self._NUMBER.match(text)
+            if m:
+                number, title, body = m.groups()
+                number, title = number.rstrip("."), title.strip()
+                if len(title) <= self.max_title and not title.endswith((".", ";", ":", "!", "?")) \
+                        and not self._NORMATIVE.search(title):
+                    self._enter(number.count(".") + 1, f"{number} {title}")
+                    body = body.strip()
+                    return Segment(body, None, self._path) if body else None
+                return Segment(text, number, self._path)
+        elif c.isupper():
+            m = self._ID.match(text)
+            if m:
+                return Segment(text, m.group(1), self._path)
+        return Segment(text, None, self._path)
+
+
+SEGMENTERS = {"paragraph": ParagraphSplitter, "structured": StructuredSegmenter}
+
+
+def make_segmenter(name="paragraph"):
+    try:
+        return SEGMENTERS[name]()
+    except KeyError:
+        raise ValueError(f"unknown segmenter {name!r}; expected one of {sorted(SEGMENTERS)}") from None
+
+
+async def iter_segments(upload, segmenter="paragraph", chunk_size=READ_CHUNK):
+    """Segments of a FastAPI UploadFile, read `chunk_size` bytes at a time."""
+    splitter = make_segmenter(segmenter)
+    while True:
+        chunk = await upload.read(chunk_size)
+        if not chunk:
+            break
+        for seg in splitter.feed(chunk):
+            yield seg
+    for seg in splitter.close():
+        yield seg
+
+
+class _Budget:
+    """Request-wide limits shared by the parse_documents() workers."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._left = {"bytes": MAX_TOTAL_BYTES, "segments": MAX_SEGMENTS, "members": MAX_MEMBERS}
+        self._limits = dict(self._left)
+        self.exceeded = None
+
+    def charge(self, kind, n, name):
+        """Count `n` bytes, segments or members; ValueError once any limit is exceeded."""
+        with self._lock:
+            if self.exceeded is None:
+                self._left[kind] -= n
+                if self._left[kind] < 0:
+                    self.exceeded = f"{name}: request exceeds {self._limits[kind]} {kind}"
+            if self.exceeded is not None:
+                raise ValueError(self.exceeded)
+
+
+def read_segments(fileobj, name="", segmenter="paragraph", chunk_size=READ_CHUNK, budget=None):
+    """Segments of a binary file object, read and split in chunks."""
+    splitter, out, total = make_segmenter(segmenter), [], 0
+    while True:
+        chunk = fileobj.read(chunk_size)
+        if not chunk:
+            break
+        total += len(chunk)
+        if total > MAX_MEMBER_BYTES:
+            raise ValueError(f"{name}: larger than {MAX_MEMBER_BYTES} bytes")
+        if budget is not None:
+            budget.charge("bytes", len(chunk), name)
+        segs = list(splitter.feed(chunk))
+        if budget is not None:
+            budget.charge("segments", len(segs), name)
+        out.extend(segs)
+    segs = list(splitter.close())
+    if budget is not None:
+        budget.charge("segments", len(segs), name)
+    out.extend(segs)
+    return out
+
+
+def _is_text_member(name):
+    return name.lower().endswith(TEXT_SUFFIXES)
+
+
+def _read_zip_member(zf, info, name, segmenter, budget=None):
+    with zf.open(info) as f:  # decompresses as it reads; nothing touches the disk
+        return read_segments(f, name, segmenter, budget=budget)
+
+
+def _read_tar(fileobj, name, segmenter, budget=None):
+    """[(member, segments)] and skipped member names of a (compressed) tar, in one streaming pass."""
+    docs, skipped = [], []
+    with tarfile.open(fileobj=fileobj, mode="r|*") as tf:
+        for m in tf:
+            if not m.isfile():
+                continue
+            member = f"{name}/{m.name}"
+            if budget is not None:
+                budget.charge("members", 1, member)
+            if _is_text_member(m.name):
+                docs.append((member, read_segments(tf.extractfile(m), member, segmenter, budget=budget)))
+            else:
+                skipped.append(member)
+    return docs, skipped
+
+
+def parse_documents(files, workers=4, segmenter="paragraph"):
+    """
+    Parse uploaded documents and archives into segments.
+
+    files: [(filename, binary file object)]. Zip and tar members with a
+    text suffix are parsed; other members are skipped. Plain files and zip
+    members are parsed concurrently on `workers` threads (zlib releases the
+    GIL); a tar stream can only be read front to back, so each tar is one
+    task. Returns ([(name, segments)] in upload/member order, [skipped]).
+
+    The whole call is limited to MAX_TOTAL_BYTES decompressed bytes,
+    MAX_SEGMENTS segments and MAX_MEMBERS documents, counted while reading;
+    ValueError when a limit is exceeded.
+    """
+    tasks, skipped = [], []
+    budget = _Budget()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for filename, f in files:
+            lower = (filename or "").lower()
+            if lower.endswith(".zip"):
+                zf = zipfile.ZipFile(f)
+                for info in zf.infolist():
+                    member = f"{filename}/{info.filename}"
+                    if info.is_dir():
+                        continue
+                    budget.charge("members", 1, member)
+                    if _is_text_member(info.filename):
+                        tasks.append(("doc", member, pool.submit(_read_zip_member, zf, info, member, segmenter, budget)))
+                    else:
+                        skipped.append(member)
+            elif lower.endswith(TAR_SUFFIXES):
+                tasks.append(("tar", filename, pool.submit(_read_tar, f, filename, segmenter, budget)))
+            else:
+                budget.charge("members", 1, filename)
+                tasks.append(("doc", filename, pool.submit(read_segments, f, filename, segmenter, READ_CHUNK, budget)))
+        docs = []
+        for kind, name, fut in tasks:
+            if kind == "tar":
+                members, tar_skipped = fut.result()
+                docs.extend(members)
+                skipped.extend(tar_skipped)
+            else:
+                docs.append((name, fut.result()))
+    return docs, skipped
@@ -1,50 +1,1025 @@
 # ledger.py
+import asyncio
+import collections
 import sqlite3
 import hashlib
+import hmac
+import itertools
+import os
+import pathlib
+import queue
+import random
+import threading
 import time
 import json
+import multiprocessing
+import db
+from concurrent.futures import Future, ProcessPoolExecutor
+
+# Per-entry hash schemes. An entry records the scheme it was chained with,
+# so entries written before a switch keep verifying under their own scheme.
+# Add new schemes with a new id; never change an existing one.
+HASH_SCHEMES = {
+    1: ("sha256", lambda blob: hashlib.sha256(blob).hexdigest()),
+    2: ("blake2b", lambda blob: hashlib.blake2b(blob, digest_size=32).hexdigest()),
+}
+SCHEME_IDS = {name: sid for sid, (name, _) in HASH_SCHEMES.items()}
+
+def _entry_hash(ts, payload, prev, scheme=1):
+    blob = f"{ts}|{payload}|{prev}"
+    return HASH_SCHEMES[scheme][1](blob.encode("utf-8"))
+
+def canonical_payload(obj):
+    """Compact, key-sorted JSON: the same event always serializes (and hashes) the same way."""
+    return json.dumps(obj, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+
+def _payload_text(payload):
+    return payload if isinstance(payload, str) else canonical_payload(payload)
+
+_ROW = "idx, timestamp, payload, prev_hash, hash, scheme"
+
+def _open_segment(uri):
+    conn = sqlite3.connect(uri, uri=True)
+    if "scheme" not in [r[1] for r in conn.execute("PRAGMA table_info(ledger)")]:
+        # Sealed before per-entry schemes existed: every entry in it is scheme 1.
+        # A temp view shadows main.ledger for unqualified queries.
+        conn.execute("CREATE TEMP VIEW ledger AS SELECT *, 1 AS scheme FROM main.ledger")
+    return conn
+
+def _verify_range(db_path, lo, hi, chunk=5000):
+    """
+    Verify entries with lo <= idx <= hi in isolation (process-pool worker).
+    Returns (first_idx, first_prev_hash, last_idx, last_hash, count, broken)
+    where broken is (idx, reason) for the first bad entry inside the range.
+    """
+    conn = _open_segment(db_path) if db_path.startswith("file:") else sqlite3.connect(db_path)
+    try:
+        cur = conn.cursor()
+        cur.execute(f"SELECT {_ROW} FROM ledger WHERE idx BETWEEN ? AND ? ORDER BY idx", (lo, hi))
+        first_idx, first_prev, last_idx, prev, count = None, None, None, None, 0
+        while True:
+            rows = cur.fetchmany(chunk)
+            if not rows:
+                break
+            for idx, ts, payload, prev_hash, h, scheme in rows:
+                if prev is None:
+                    first_idx, first_prev = idx, prev_hash
+                elif prev_hash != prev:
+                    return first_idx, first_prev, last_idx, prev, count, (idx, "prev_hash does not match previous entry")
+                if _entry_hash(ts, payload, prev_hash, scheme) != h:
+                    return first_idx, first_prev, last_idx, prev, count, (idx, "hash does not match entry contents")
+                prev, last_idx = h, idx
+                count += 1
+        return first_idx, first_prev, last_idx, prev, count, None
+    finally:
+        conn.close()
+
+_INSERT_SQL = "INSERT INTO ledger (idx, timestamp, payload, prev_hash, hash, scheme, project_id, action) VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+
+def _payload_meta(payload):
+    """(project_id, action) of a JSON payload, for the indexed ledger columns."""
+    try:
+        d = json.loads(payload)
+    except (TypeError, ValueError):
+        return None, None
+    if not isinstance(d, dict):
+        return None, None
+    project_id = d.get("project_id")
+    return (project_id if isinstance(project_id, int) else None), d.get("action")
+
+def _entry_dict(r):
+    return {"idx": r[0], "timestamp": r[1], "payload": r[2], "prev_hash": r[3], "hash": r[4],
+            "scheme": HASH_SCHEMES[r[5]][0]}
+
+def _new_project_state():
+    return {"ingests": 0, "requirements_ingested": 0, "generations": 0, "approved_tests": set()}
+
+def _apply_event(state, payload):
+    """Fold one ledger payload into the derived per-project state (approvals as sets while replaying)."""
+    try:
+        d = json.loads(payload)
+    except (TypeError, ValueError):
+        return
+    if not isinstance(d, dict) or d.get("project_id") is None:
+        return
+    p = state.setdefault(str(d["project_id"]), _new_project_state())
+    action = d.get("action")
+    if action == "ingest":
+        p["ingests"] += 1
+        p["requirements_ingested"] += d.get("count", 0)
+    elif action == "generate":
+        p["generations"] += 1
+    elif action == "approve_test":
+        p["approved_tests"].add(d.get("test_id"))
+
+def _dump_state(state):
+    return {pid: dict(p, approved_tests=sorted(p["approved_tests"])) for pid, p in state.items()}
+
+def _load_state(state):
+    return {pid: dict(p, approved_tests=set(p["approved_tests"])) for pid, p in state.items()}
+
+def _merkle_leaf(entry_hash):
+    return hashlib.sha256(b"\x00" + bytes.fromhex(entry_hash)).hexdigest()
+
+def _merkle_node(left, right):
+    return hashlib.sha256(b"\x01" + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
 
 class Ledger:
-    def __init__(self, db_path="equilix.db"):
+    def __init__(self, db_path="equilix.db", group_commit=False, max_batch=64, max_linger_ms=2.0,
+                 write_retries=8, checkpoint_key=None, merkle_epoch=256,
+                 segment_rows=None, hash_scheme="sha256", snapshot_every=None, snapshot_keep=2,
+                 synchronous="FULL"):
+        """
+        group_commit: queue concurrent appends and flush them in one transaction
+        per batch (at most `max_batch` entries, waiting at most `max_linger_ms`
+        for followers). Each caller still gets its own hash once durable.
+
+        Writes take the database write lock up front (BEGIN IMMEDIATE), so
+        several processes sharing the same file (e.g. uvicorn workers) append
+        one after another and the chain never forks. If the lock stays busy
+        past the pool's busy timeout (see db.py), the write is retried with
+        jittered exponential backoff up to `write_retries` times.
+
+        checkpoint_key: secret used to HMAC-sign verification checkpoints, so
+        a tampered checkpoints table is detected by verify(). Without a key
+        anyone with database access could forge a checkpoint, so none are
+        stored or trusted and every verify() starts from genesis.
+
+        merkle_epoch: number of new entries after which the Merkle index is
+        extended as part of the append path (it is also brought up to date
+        whenever a root or proof is requested).
+
+        segment_rows: once the live table holds this many entries they are
+        sealed into a read-only segment file (see seal_segment()). Reads,
+        verification, proofs and export span segments transparently.
+
+        hash_scheme: scheme for new entries (a HASH_SCHEMES name).
+
+        snapshot_every: store a project_state() snapshot whenever this many
+        entries have been appended since the last one. Only the latest
+        `snapshot_keep` snapshots are kept.
+
+        synchronous: SQLite synchronous level for appends and sealing. FULL
+        fsyncs the WAL on every commit, so an appended entry survives power
+        loss; the pool's default (NORMAL) only survives a process crash.
+        """
         self.db_path = db_path
+        self.write_retries = write_retries
+        self._checkpoint_key = (checkpoint_key or "").encode("utf-8")
+        self.merkle_epoch = merkle_epoch
+        self._merkle_size = 0
+        self.segment_rows = segment_rows
+        self.hash_scheme = SCHEME_IDS[hash_scheme]
+        self.snapshot_every = snapshot_every
+        self.snapshot_keep = max(1, snapshot_keep)
+        self.synchronous = synchronous
+        self._snapshot_idx = 0
+        self._sealed_idx = 0  # last idx moved out of the live table
+        self.max_batch = max_batch
+        self.max_linger_ms = max_linger_ms
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._tail = (0, "")  # (idx, hash) of the current chain head
         self._init()
+        self._queue = None
+        self._writer = None
+        if group_commit:
+            self._queue = queue.Queue()
+            self._writer = threading.Thread(target=self._writer_loop, name="ledger-writer", daemon=True)
+            self._writer.start()
 
     def _init(self):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("""
-        CREATE TABLE IF NOT EXISTS ledger (
-            idx INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp REAL,
-            payload TEXT,
-            prev_hash TEXT,
-            hash TEXT
-        )""")
-        conn.commit()
-        conn.close()
+        with db.connect(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger (
+                idx INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp REAL,
+                payload TEXT,
+                prev_hash TEXT,
+                hash TEXT,
+                project_id INTEGER,
+                action TEXT,
+                scheme INTEGER NOT NULL DEFAULT 1
+            )""")
+            self._migrate_columns(cur)
+            cur.execute("CREATE INDEX IF NOT EXISTS ledger_project_idx ON ledger (project_id, idx)")
+            cur.execute("CREATE INDEX IF NOT EXISTS ledger_timestamp_idx ON ledger (timestamp)")
+            # Sealed segments: contiguous idx ranges moved to read-only files. The
+            # first entry of each segment chains off the last hash of the previous.
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_segments (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                path TEXT,
+                start_idx INTEGER,
+                end_idx INTEGER,
+                first_prev_hash TEXT,
+                last_hash TEXT,
+                first_ts REAL,
+                last_ts REAL,
+                sealed_at REAL
+            )""")
+            # A writer with a stale head would otherwise re-use an idx that was
+            # sealed away (no primary-key collision left in the live table).
+            cur.execute("""
+            CREATE TRIGGER IF NOT EXISTS ledger_sealed_guard BEFORE INSERT ON ledger
+            WHEN NEW.idx <= (SELECT end_idx FROM ledger_segments ORDER BY seq DESC LIMIT 1)
+            BEGIN
+                SELECT RAISE(ABORT, 'ledger idx already sealed into a segment');
+            END""")
+            # Derived state (see project_state) materialized at a ledger position.
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_snapshots (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idx INTEGER,
+                hash TEXT,
+                state TEXT,
+                created_at REAL
+            )""")
+            # One row per project and snapshot, so reading one project's state
+            # does not parse every project's. (Older snapshots kept the whole
+            # state in ledger_snapshots.state.)
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_snapshot_projects (
+                idx INTEGER,
+                project_id TEXT,
+                state TEXT,
+                PRIMARY KEY (idx, project_id)
+            ) WITHOUT ROWID""")
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_checkpoints (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                idx INTEGER,
+                hash TEXT,
+                verified_at REAL,
+                signature TEXT
+            )""")
+            # Merkle index over entry hashes: leaf i is the entry with idx i+1.
+            # Node (level, pos) covers leaves [pos << level, (pos+1) << level); a
+            # node without a right sibling is promoted unchanged.
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_merkle_nodes (
+                level INTEGER,
+                pos INTEGER,
+                hash TEXT,
+                PRIMARY KEY (level, pos)
+            ) WITHOUT ROWID""")
+            cur.execute("""
+            CREATE TABLE IF NOT EXISTS ledger_merkle_epochs (
+                epoch INTEGER PRIMARY KEY AUTOINCREMENT,
+                size INTEGER,
+                root TEXT,
+                created_at REAL
+            )""")
+            conn.commit()
+            self._tail = self._read_tail(cur)
+            self._merkle_size = self._read_merkle_epoch(cur)[1]
+            self._sealed_idx = self._read_sealed_idx(cur)
+            cur.execute("SELECT MAX(idx) FROM ledger_snapshots")
+            self._snapshot_idx = cur.fetchone()[0] or 0
 
-    def append(self, payload: str):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT hash FROM ledger ORDER BY idx DESC LIMIT 1")
+    def _migrate_columns(self, cur):
+        """Add columns missing from ledgers created by older versions, backfilling where needed."""
+        migrations = [
+            ("project_id", ["ALTER TABLE ledger ADD COLUMN project_id INTEGER",
+                            "ALTER TABLE ledger ADD COLUMN action TEXT",
+                            """UPDATE ledger SET project_id = json_extract(payload, '$.project_id'),
+                                                 action = json_extract(payload, '$.action')
+                               WHERE json_valid(payload)"""]),
+            # entries written before schemes existed are all sha256
+            ("scheme", ["ALTER TABLE ledger ADD COLUMN scheme INTEGER NOT NULL DEFAULT 1"]),
+        ]
+        cur.execute("PRAGMA table_info(ledger)")
+        columns = [r[1] for r in cur.fetchall()]
+        if all(col in columns for col, _ in migrations):
+            return
+        self._begin_immediate(cur)
+        cur.execute("PRAGMA table_info(ledger)")
+        columns = [r[1] for r in cur.fetchall()]
+        for col, statements in migrations:
+            if col not in columns:
+                for sql in statements:
+                    cur.execute(sql)
+        cur.connection.commit()
+
+    def _read_tail(self, cur):
+        cur.execute("SELECT idx, hash FROM ledger ORDER BY idx DESC LIMIT 1")
+        row = cur.fetchone()
+        if not row:
+            # everything sealed: the head is the end of the newest segment
+            cur.execute("SELECT end_idx, last_hash FROM ledger_segments ORDER BY seq DESC LIMIT 1")
+            row = cur.fetchone()
+        return (row[0], row[1]) if row else (0, "")
+
+    def _read_sealed_idx(self, cur):
+        cur.execute("SELECT end_idx FROM ledger_segments ORDER BY seq DESC LIMIT 1")
         row = cur.fetchone()
-        prev = row[0] if row else ""
-        ts = time.time()
-        blob = f"{ts}|{payload}|{prev}"
-        h = hashlib.sha256(blob.encode("utf-8")).hexdigest()
-        cur.execute("INSERT INTO ledger (timestamp, payload, prev_hash, hash) VALUES (?, ?, ?, ?)",
-                    (ts, payload, prev, h))
+        return row[0] if row else 0
+
+    def append(self, payload):
+        if self._queue is None:
+            return self.append_many([payload])[0]
+        fut = Future()
+        self._queue.put((payload, fut))
+        return fut.result()
+
+    def append_many(self, payloads):
+        """
+        Chain and commit `payloads` in order in a single transaction; returns
+        their hashes. Dict payloads are stored in canonical JSON form.
+        """
+        if not payloads:
+            return []
+        payloads = [_payload_text(p) for p in payloads]
+        with self._lock:
+            with db.connect(self.db_path, synchronous=self.synchronous) as conn:
+                cur = conn.cursor()
+                self._begin_immediate(cur)
+                try:
+                    rows, hashes = self._chain(payloads)
+                    try:
+                        # Explicit idx: if another process advanced the chain the
+                        # primary key collides. We hold the write lock, so the head
+                        # re-read here is stable and the retry cannot collide again.
+                        cur.executemany(_INSERT_SQL, rows)
+                    except sqlite3.IntegrityError:
+                        self._tail = self._read_tail(cur)
+                        rows, hashes = self._chain(payloads)
+                        cur.executemany(_INSERT_SQL, rows)
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+                self._tail = (rows[-1][0], hashes[-1])
+        # The entries are committed: a failing follow-up step must not make
+        # the caller think otherwise (and append them again). Each step is
+        # retried by the next append that finds it due.
+        try:
+            self._notify(rows)
+            if self.merkle_epoch and self._tail[0] - self._merkle_size >= self.merkle_epoch:
+                self.merkle_sync()
+            if self.segment_rows and self._tail[0] - self._sealed_idx >= self.segment_rows:
+                self.seal_segment()
+            if self.snapshot_every and self._tail[0] - self._snapshot_idx >= self.snapshot_every:
+                self.snapshot()
+        except Exception as e:
+            print("⚠️ ledger post-commit step failed:", e)
+        return hashes
+
+    def add_listener(self, fn):
+        """Call fn(entries) with the entry dicts (plus project_id) of every batch this process commits."""
+        self._listeners.append(fn)
+
+    def _notify(self, rows):
+        if self._listeners:
+            entries = [dict(_entry_dict(r), project_id=r[6]) for r in rows]
+            for fn in self._listeners:
+                fn(entries)
+
+    def _begin_immediate(self, cur):
+        delay = 0.005
+        for attempt in range(self.write_retries + 1):
+            try:
+                cur.execute("BEGIN IMMEDIATE")
+                return
+            except sqlite3.OperationalError as e:
+                if "locked" not in str(e) and "busy" not in str(e):
+                    raise
+                if attempt == self.write_retries:
+                    raise
+                time.sleep(delay * (1 + random.random()))
+                delay = min(delay * 2, 0.5)
+
+    def _chain(self, payloads):
+        idx, prev = self._tail
+        rows, hashes = [], []
+        for payload in payloads:
+            idx += 1
+            ts = time.time()
+            h = _entry_hash(ts, payload, prev, self.hash_scheme)
+            rows.append((idx, ts, payload, prev, h, self.hash_scheme) + _payload_meta(payload))
+            hashes.append(h)
+            prev = h
+        return rows, hashes
+
+    def _writer_loop(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_linger_ms / 1000.0
+            while len(batch) < self.max_batch:
+                timeout = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            try:
+                hashes = self.append_many([p for p, _ in batch])
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+            else:
+                for (_, fut), h in zip(batch, hashes):
+                    fut.set_result(h)
+            if stop:
+                return
+
+    def close(self):
+        """Flush queued appends and stop the group-commit writer."""
+        if self._writer is not None:
+            self._queue.put(None)
+            self._writer.join()
+            self._writer = None
+            self._queue = None
+
+    def _sign(self, idx, h):
+        return hmac.new(self._checkpoint_key, f"{idx}|{h}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def verify(self, full=False, chunk=1000):
+        """
+        Verify the hash chain from the last checkpoint (or from genesis when
+        `full` is set, no checkpoint exists or there is no checkpoint key).
+        On success a new signed checkpoint is stored at the head, so the next
+        call only checks rows appended since.
+        """
+        with db.connect(self.db_path) as conn:
+            cur = conn.cursor()
+            start_idx, prev = 0, ""
+            if not full and self._checkpoint_key:
+                cur.execute("SELECT idx, hash, signature FROM ledger_checkpoints ORDER BY id DESC LIMIT 1")
+                cp = cur.fetchone()
+                if cp:
+                    if not hmac.compare_digest(cp[2] or "", self._sign(cp[0], cp[1])):
+                        return {"ok": False, "from_idx": cp[0], "broken_at": cp[0], "reason": "checkpoint signature mismatch"}
+                    row = self._get_row(conn, cp[0])
+                    if not row or row[4] != cp[1]:
+                        return {"ok": False, "from_idx": cp[0], "broken_at": cp[0], "reason": "checkpointed entry changed"}
+                    start_idx, prev = cp[0], cp[1]
+
+            last_idx, checked = start_idx, 0
+            for idx, ts, payload, prev_hash, h, scheme in self._iter_rows(conn, start_idx, chunk=chunk):
+                if prev_hash != prev:
+                    return {"ok": False, "from_idx": start_idx, "broken_at": idx, "reason": "prev_hash does not match previous entry"}
+                if _entry_hash(ts, payload, prev_hash, scheme) != h:
+                    return {"ok": False, "from_idx": start_idx, "broken_at": idx, "reason": "hash does not match entry contents"}
+                prev, last_idx = h, idx
+                checked += 1
+
+            if checked:
+                self._store_checkpoint(conn, last_idx, prev)
+            return {"ok": True, "from_idx": start_idx, "to_idx": last_idx, "checked": checked}
+
+    def _store_checkpoint(self, conn, idx, h):
+        if not self._checkpoint_key:
+            return
+        conn.execute("INSERT INTO ledger_checkpoints (idx, hash, verified_at, signature) VALUES (?, ?, ?, ?)",
+                     (idx, h, time.time(), self._sign(idx, h)))
         conn.commit()
-        conn.close()
-        return h
 
-    def read_latest(self, limit:int=50):
-        conn = sqlite3.connect(self.db_path)
-        cur = conn.cursor()
-        cur.execute("SELECT idx, timestamp, payload, prev_hash, hash FROM ledger ORDER BY idx DESC LIMIT ?", (limit,))
-        rows = cur.fetchall()
-        conn.close()
-        out = []
-        for r in rows:
-            out.append({"idx": r[0], "timestamp": r[1], "payload": r[2], "prev_hash": r[3], "hash": r[4]})
+    def verify_full(self, workers=None, range_size=50000):
+        """
+        From-genesis verification split into idx ranges of `range_size` that
+        are re-hashed in parallel on a process pool. Range boundaries are
+        stitched in order here, so the first broken link is reported exactly
+        as verify(full=True) would.
+        """
+        with db.connect(self.db_path) as conn:
+            sources = self._sources(conn)
+            lo, hi = conn.execute("SELECT MIN(idx), MAX(idx) FROM ledger").fetchone()
+        spans = [(uri, start, end) for start, end, _, _, uri in sources[:-1]]
+        if lo is not None:
+            spans.append((self.db_path, lo, hi))
+        if not spans:
+            return {"ok": True, "from_idx": 0, "to_idx": 0, "checked": 0}
+
+        # One process per core at most. Workers are not forked from the server:
+        # a fork of a threaded process can inherit locks held by other threads
+        # and the pool's open SQLite connections.
+        cpus = os.cpu_count() or 1
+        workers = max(1, min(workers or cpus, cpus))
+        ranges = [(path, a, min(a + range_size - 1, hi)) for path, lo, hi in spans for a in range(lo, hi + 1, range_size)]
+        prev, last_idx, checked = "", 0, 0
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(method)) as pool:
+            # Keep a bounded window of ranges in flight so memory stays flat.
+            pending = [pool.submit(_verify_range, *r) for r in ranges[:workers * 2]]
+            for i in range(len(ranges)):
+                first_idx, first_prev, r_last_idx, r_last_hash, count, broken = pending[i].result()
+                pending[i] = None
+                if len(pending) < len(ranges):
+                    pending.append(pool.submit(_verify_range, *ranges[len(pending)]))
+                if first_idx is not None and first_prev != prev:
+                    return {"ok": False, "from_idx": 0, "broken_at": first_idx, "reason": "prev_hash does not match previous entry"}
+                if broken:
+                    return {"ok": False, "from_idx": 0, "broken_at": broken[0], "reason": broken[1]}
+                if count:
+                    prev, last_idx = r_last_hash, r_last_idx
+                    checked += count
+        self._store_checkpoint_at(last_idx, prev)
+        return {"ok": True, "from_idx": 0, "to_idx": last_idx, "checked": checked}
+
+    def _store_checkpoint_at(self, idx, h):
+        with db.connect(self.db_path) as conn:
+            self._store_checkpoint(conn, idx, h)
+
+    def _read_merkle_epoch(self, cur):
+        cur.execute("SELECT epoch, size, root FROM ledger_merkle_epochs ORDER BY epoch DESC LIMIT 1")
+        row = cur.fetchone()
+        return row if row else (0, 0, "")
+
+    def merkle_sync(self, chunk=10000):
+        """Extend the Merkle index with entries appended since the last epoch; returns (epoch, size, root)."""
+        with db.connect(self.db_path) as conn:
+            cur = conn.cursor()
+            self._begin_immediate(cur)
+            try:
+                epoch = self._read_merkle_epoch(cur)
+                size = epoch[1]
+                rows = self._iter_rows(conn, size, chunk=chunk)
+                while True:
+                    leaves = [r[4] for r in itertools.islice(rows, chunk)]
+                    if not leaves:
+                        break
+                    root = self._merkle_extend(cur, size, leaves)
+                    size += len(leaves)
+                if size != epoch[1]:
+                    cur.execute("INSERT INTO ledger_merkle_epochs (size, root, created_at) VALUES (?, ?, ?)",
+                                (size, root, time.time()))
+                    epoch = (cur.lastrowid, size, root)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+        self._merkle_size = epoch[1]
+        return epoch
+
+    def _merkle_extend(self, cur, size, leaves):
+        """Add `leaves` at positions size.. and recompute the affected right spine; returns the new root."""
+        n = size + len(leaves)
+        nodes = {size + i: _merkle_leaf(h) for i, h in enumerate(leaves)}
+        updates = [(0, p, h) for p, h in nodes.items()]
+        lo, hi, level = size, n - 1, 0
+        while (1 << level) < n:
+            upper = {}
+            for p in range(lo >> 1, (hi >> 1) + 1):
+                left = nodes.get(2 * p) or self._merkle_get(cur, level, 2 * p)
+                if ((2 * p + 1) << level) < n:
+                    upper[p] = _merkle_node(left, nodes[2 * p + 1])
+                else:
+                    upper[p] = left
+            level += 1
+            nodes, lo, hi = upper, lo >> 1, hi >> 1
+            updates.extend((level, p, h) for p, h in nodes.items())
+        cur.executemany("INSERT OR REPLACE INTO ledger_merkle_nodes (level, pos, hash) VALUES (?, ?, ?)", updates)
+        return nodes[0]
+
+    def _merkle_get(self, cur, level, pos):
+        cur.execute("SELECT hash FROM ledger_merkle_nodes WHERE level = ? AND pos = ?", (level, pos))
+        return cur.fetchone()[0]
+
+    def merkle_root(self):
+        epoch, size, root = self.merkle_sync()
+        return {"epoch": epoch, "tree_size": size, "root": root}
+
+    def merkle_proof(self, idx: int):
+        """O(log n) inclusion proof for the entry at `idx` against the current root, or None."""
+        self.merkle_sync()
+        with db.connect(self.db_path) as conn:
+            cur = conn.cursor()
+            cur.execute("BEGIN")  # root and nodes from one consistent snapshot
+            epoch, n, root = self._read_merkle_epoch(cur)
+            leaf = idx - 1
+            if leaf < 0 or leaf >= n:
+                return None
+            entry_hash = self._get_row(conn, idx)[4]
+            proof, level = [], 0
+            while (1 << level) < n:
+                pos = leaf >> level
+                sib = pos ^ 1
+                if (sib << level) < n:
+                    proof.append({"side": "left" if sib < pos else "right", "hash": self._merkle_get(cur, level, sib)})
+                level += 1
+            conn.rollback()
+            return {"idx": idx, "hash": entry_hash, "epoch": epoch, "tree_size": n, "root": root, "proof": proof}
+
+    @staticmethod
+    def verify_inclusion(entry_hash, proof, root):
+        """Check a merkle_proof() result without access to the ledger."""
+        h = _merkle_leaf(entry_hash)
+        for step in proof:
+            h = _merkle_node(step["hash"], h) if step["side"] == "left" else _merkle_node(h, step["hash"])
+        return h == root
+
+    def read_latest(self, limit:int=50, project_id:int=None, before_idx:int=None, after_idx:int=None,
+                    from_ts:float=None, to_ts:float=None):
+        """
+        Newest-first page of entries. Pages are addressed by keyset cursors:
+        pass the smallest idx of a page as `before_idx` to get the next
+        (older) page, or the largest as `after_idx` for the newer one.
+        `from_ts`/`to_ts` bound the entry timestamp (inclusive).
+        """
+        where, params = [], []
+        if project_id is not None:
+            where.append("project_id = ?"); params.append(project_id)
+        if before_idx is not None:
+            where.append("idx < ?"); params.append(before_idx)
+        if after_idx is not None:
+            where.append("idx > ?"); params.append(after_idx)
+        if from_ts is not None:
+            where.append("timestamp >= ?"); params.append(from_ts)
+        if to_ts is not None:
+            where.append("timestamp <= ?"); params.append(to_ts)
+        # Paging forward from after_idx takes the rows right after the cursor.
+        order = "ASC" if after_idx is not None and before_idx is None else "DESC"
+        sql = f"SELECT {_ROW} FROM ledger"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += f" ORDER BY idx {order} LIMIT ?"
+        with db.connect(self.db_path) as conn:
+            sources = self._sources(conn)
+            if order == "DESC":
+                sources.reverse()
+            rows = []
+            for start, end, first_ts, last_ts, uri in sources:
+                if before_idx is not None and start >= before_idx:
+                    continue
+                if after_idx is not None and end is not None and end <= after_idx:
+                    continue
+                if (from_ts is not None and last_ts is not None and last_ts < from_ts) or \
+                   (to_ts is not None and first_ts is not None and first_ts > to_ts):
+                    continue
+                src = self._connect_source(conn, uri)
+                try:
+                    rows.extend(src.execute(sql, params + [limit - len(rows)]).fetchall())
+                finally:
+                    if src is not conn:
+                        src.close()
+                if len(rows) >= limit:
+                    break
+        if order == "ASC":
+            rows.reverse()
+        return [_entry_dict(r) for r in rows]
+
+    # --- derived state ---
+
+    def _replay(self, conn, project_id=None):
+        """Latest valid snapshot plus the entries after it: (state, idx, hash)."""
+        state, idx, h = {}, 0, ""
+        row = conn.execute("SELECT idx, hash, state FROM ledger_snapshots ORDER BY idx DESC LIMIT 1").fetchone()
+        if row:
+            entry = self._get_row(conn, row[0])
+            # A snapshot whose entry no longer matches is ignored: replay from genesis.
+            if entry and entry[4] == row[1]:
+                idx, h = row[0], row[1]
+                if row[2] is not None:
+                    state = _load_state(json.loads(row[2]))
+                    if project_id is not None:
+                        state = {k: v for k, v in state.items() if k == str(project_id)}
+                else:
+                    sql, params = "SELECT project_id, state FROM ledger_snapshot_projects WHERE idx = ?", [idx]
+                    if project_id is not None:
+                        sql += " AND project_id = ?"
+                        params.append(str(project_id))
+                    state = _load_state({pid: json.loads(st) for pid, st in conn.execute(sql, params)})
+        for r in self._iter_rows(conn, idx, project_id=project_id):
+            _apply_event(state, r[2])
+            idx, h = r[0], r[4]
+        return state, idx, h
+
+    def project_state(self, project_id:int=None):
+        """
+        Per-project counters and approved test ids derived from the ledger,
+        computed from the latest snapshot plus a replay of the tail.
+        """
+        with db.connect(self.db_path) as conn:
+            state, idx, h = self._replay(conn, project_id)
+        if project_id is not None:
+            state = {str(project_id): state.get(str(project_id), _new_project_state())}
+        state = _dump_state(state)
+        if project_id is not None:
+            state = state[str(project_id)]
+        return {"as_of_idx": idx, "as_of_hash": h, "state": state}
+
+    def snapshot(self):
+        """
+        Materialize project_state() for all projects at the current head and
+        drop all but the latest `snapshot_keep` snapshots; returns its idx.
+        """
+        with db.connect(self.db_path) as conn:
+            state, idx, h = self._replay(conn)
+            if idx and not conn.execute("SELECT 1 FROM ledger_snapshots WHERE idx = ?", (idx,)).fetchone():
+                conn.execute("INSERT INTO ledger_snapshots (idx, hash, state, created_at) VALUES (?, ?, NULL, ?)",
+                             (idx, h, time.time()))
+                conn.executemany("INSERT INTO ledger_snapshot_projects (idx, project_id, state) VALUES (?, ?, ?)",
+                                 [(idx, pid, json.dumps(p)) for pid, p in _dump_state(state).items()])
+                oldest = conn.execute("SELECT idx FROM ledger_snapshots ORDER BY idx DESC LIMIT 1 OFFSET ?",
+                                      (self.snapshot_keep - 1,)).fetchone()
+                if oldest:  # fewer than snapshot_keep snapshots: nothing to prune
+                    conn.execute("DELETE FROM ledger_snapshots WHERE idx < ?", oldest)
+                    conn.execute("DELETE FROM ledger_snapshot_projects WHERE idx < ?", oldest)
+                conn.commit()
+        self._snapshot_idx = idx
+        return idx
+
+    def iter_entries(self, project_id:int=None, after_idx:int=0, chunk:int=1000):
+        """
+        Yield entries oldest-first, `chunk` rows per keyset query, so memory
+        stays constant however large the ledger is.
+        """
+        # Not pooled: a generator may be resumed on another thread
+        # (StreamingResponse iterates in the threadpool).
+        conn = db.pool.dedicated(self.db_path)
+        try:
+            for r in self._iter_rows(conn, after_idx, project_id=project_id, chunk=chunk):
+                yield _entry_dict(r)
+        finally:
+            conn.close()
+
+    # --- segments ---
+
+    def _segment_path(self, name):
+        return os.path.join(os.path.dirname(os.path.abspath(self.db_path)), name)
+
+    def _sources(self, conn):
+        """
+        Where entries live, oldest first: (start_idx, end_idx, first_ts,
+        last_ts, uri) for every sealed segment, then the live table with
+        end_idx/timestamps/uri None.
+        """
+        rows = conn.execute("SELECT start_idx, end_idx, first_ts, last_ts, path FROM ledger_segments ORDER BY seq").fetchall()
+        out = [(a, b, t0, t1, pathlib.Path(self._segment_path(p)).as_uri() + "?mode=ro") for a, b, t0, t1, p in rows]
+        out.append((rows[-1][1] + 1 if rows else 1, None, None, None, None))
         return out
+
+    def _connect_source(self, conn, uri):
+        return conn if uri is None else _open_segment(uri)
+
+    def _iter_rows(self, conn, after_idx=0, project_id=None, chunk=1000):
+        while True:
+            for start, end, _, _, uri in self._sources(conn):
+                if end is not None and end <= after_idx:
+                    continue
+                src = self._connect_source(conn, uri)
+                try:
+                    while True:
+                        if project_id is None:
+                            rows = src.execute(f"SELECT {_ROW} FROM ledger WHERE idx > ? ORDER BY idx LIMIT ?",
+                                               (after_idx, chunk)).fetchall()
+                        else:
+                            rows = src.execute(f"SELECT {_ROW} FROM ledger WHERE project_id = ? AND idx > ? ORDER BY idx LIMIT ?",
+                                               (project_id, after_idx, chunk)).fetchall()
+                        yield from rows
+                        if len(rows) < chunk:
+                            break
+                        after_idx = rows[-1][0]
+                    if end is not None:
+                        after_idx = max(after_idx, end)
+                finally:
+                    if src is not conn:
+                        src.close()
+            # Live rows sealed away while we were reading: pick them up from the new segment.
+            if self._read_sealed_idx(conn.cursor()) <= after_idx:
+                return
+
+    def _get_row(self, conn, idx):
+        for start, end, _, _, uri in self._sources(conn):
+            if idx >= start and (end is None or idx <= end):
+                src = self._connect_source(conn, uri)
+                try:
+                    return src.execute(f"SELECT {_ROW} FROM ledger WHERE idx = ?", (idx,)).fetchone()
+                finally:
+                    if src is not conn:
+                        src.close()
+        return None
+
+    def seal_segment(self, upto_idx:int=None):
+        """
+        Move live entries up to `upto_idx` (default: all of them) into a new
+        read-only SQLite file next to the database and drop them from the
+        live table. The chain is untouched: the next live entry still links
+        to the segment's last hash. Returns the segment's metadata, or None
+        if there was nothing to seal.
+        """
+        with self._lock:
+            with db.connect(self.db_path, synchronous=self.synchronous) as conn:
+                cur = conn.cursor()
+                lo, hi = cur.execute("SELECT MIN(idx), MAX(idx) FROM ledger").fetchone()
+                if upto_idx is not None and hi is not None:
+                    hi = min(hi, upto_idx)
+                if lo is None or hi < lo:
+                    return None
+                name = f"{os.path.basename(self.db_path)}.seg{lo:012d}-{hi:012d}"
+                path = self._segment_path(name)
+                tmp = f"{path}.tmp{os.getpid()}"
+                meta = self._write_segment(tmp, lo, hi)
+                moved = False
+                self._begin_immediate(cur)
+                try:
+                    # Another process may have sealed the same range meanwhile.
+                    if cur.execute("SELECT MIN(idx), COUNT(*) FROM ledger WHERE idx <= ?", (hi,)).fetchone() != (lo, meta["rows"]):
+                        conn.rollback()
+                        os.remove(tmp)
+                        return None
+                    os.replace(tmp, path)
+                    moved = True
+                    os.chmod(path, 0o444)
+                    cur.execute("""INSERT INTO ledger_segments
+                                   (path, start_idx, end_idx, first_prev_hash, last_hash, first_ts, last_ts, sealed_at)
+                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                                (name, lo, hi, meta["first_prev_hash"], meta["last_hash"], meta["first_ts"], meta["last_ts"], time.time()))
+                    cur.execute("DELETE FROM ledger WHERE idx <= ?", (hi,))
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    os.remove(path if moved else tmp)
+                    raise
+                self._sealed_idx = hi
+                return dict(meta, path=name, start_idx=lo, end_idx=hi)
+
+    def _write_segment(self, path, lo, hi):
+        seg = sqlite3.connect(path)
+        try:
+            seg.execute("""
+            CREATE TABLE ledger (
+                idx INTEGER PRIMARY KEY,
+                timestamp REAL,
+                payload TEXT,
+                prev_hash TEXT,
+                hash TEXT,
+                project_id INTEGER,
+                action TEXT,
+                scheme INTEGER NOT NULL DEFAULT 1
+            )""")
+            seg.execute("ATTACH DATABASE ? AS live", (self.db_path,))
+            seg.execute("""INSERT INTO ledger (idx, timestamp, payload, prev_hash, hash, project_id, action, scheme)
+                           SELECT idx, timestamp, payload, prev_hash, hash, project_id, action, scheme
+                           FROM live.ledger WHERE idx BETWEEN ? AND ? ORDER BY idx""", (lo, hi))
+            seg.commit()
+            seg.execute("DETACH DATABASE live")
+            seg.execute("CREATE INDEX ledger_project_idx ON ledger (project_id, idx)")
+            seg.execute("CREATE INDEX ledger_timestamp_idx ON ledger (timestamp)")
+            seg.commit()
+            first_prev, first_ts = seg.execute("SELECT prev_hash, timestamp FROM ledger ORDER BY idx LIMIT 1").fetchone()
+            last_hash, last_ts = seg.execute("SELECT hash, timestamp FROM ledger ORDER BY idx DESC LIMIT 1").fetchone()
+            rows = seg.execute("SELECT COUNT(*) FROM ledger").fetchone()[0]
+        finally:
+            seg.close()
+        return {"rows": rows, "first_prev_hash": first_prev, "last_hash": last_hash, "first_ts": first_ts, "last_ts": last_ts}
+
+class AsyncLedgerWriter:
+    """
+    asyncio front-end for a ledger: handlers enqueue entries and get a
+    pending id back immediately, while a background task commits them in
+    batches off the event loop. wait()/flush() are the durability barriers
+    for callers that must not return before their entry is on disk.
+
+    A failed batch is retried `retries` times with exponential backoff
+    (from `retry_delay` seconds) before its entries are given up on; wait()
+    then raises the last error for them instead of reporting them unknown.
+
+    Pending ids are strings prefixed with the pid and a random nonce, so
+    with several worker processes an id issued by another worker (or a
+    previous run) is never mistaken for one of this writer's.
+    """
+    def __init__(self, ledger, max_queue=10000, max_batch=256, keep_results=10000, retries=5, retry_delay=0.1):
+        self.ledger = ledger
+        self.max_queue = max_queue
+        self.max_batch = max_batch
+        self.keep_results = keep_results
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self._prefix = f"{os.getpid()}-{os.urandom(4).hex()}"
+        self._ids = itertools.count(1)
+        self._pending = {}  # pending id -> future resolving to the entry hash
+        self._done = collections.OrderedDict()  # recent pending id -> hash, or the exception it failed with
+        self._loop = None
+        self._queue = None
+        self._task = None
+
+    @property
+    def running(self):
+        return self._task is not None
+
+    async def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(self.max_queue)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        await self.flush()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def submit(self, payload) -> str:
+        """Enqueue `payload` (waiting only if the queue is full); returns its pending id."""
+        pending_id = f"{self._prefix}-{next(self._ids)}"
+        fut = self._loop.create_future()
+        self._pending[pending_id] = fut
+        await self._queue.put((pending_id, payload, fut))
+        return pending_id
+
+    def submit_threadsafe(self, payload) -> str:
+        """submit() for sync handlers running in the threadpool."""
+        return asyncio.run_coroutine_threadsafe(self.submit(payload), self._loop).result()
+
+    async def wait(self, pending_id: str):
+        """
+        Block until the entry is committed; returns its hash, or None if the
+        id is unknown (expired, or not issued by this writer). Raises the write error if the entry could not be
+        committed.
+        """
+        fut = self._pending.get(pending_id)
+        if fut is not None:
+            return await asyncio.shield(fut)
+        result = self._done.get(pending_id)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def wait_threadsafe(self, pending_id: str):
+        return asyncio.run_coroutine_threadsafe(self.wait(pending_id), self._loop).result()
+
+    async def flush(self):
+        """Block until everything submitted so far is committed."""
+        if self._pending:
+            await asyncio.gather(*self._pending.values(), return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            payloads = [p for _, p, _ in batch]
+            for attempt in range(self.retries + 1):
+                try:
+                    # Ledger.append_many commits all or nothing and does not raise once
+                    # committed, so a retry does not append entries twice.
+                    results = await asyncio.to_thread(self.ledger.append_many, payloads)
+                    break
+                except Exception as e:
+                    if attempt == self.retries:
+                        print(f"⚠️ ledger write failed, {len(batch)} entries not recorded:", e)
+                        results = [e] * len(batch)
+                    else:
+                        print(f"⚠️ ledger write failed (attempt {attempt + 1}), retrying:", e)
+                        await asyncio.sleep(self.retry_delay * 2 ** attempt)
+            for (pending_id, _, fut), r in zip(batch, results):
+                del self._pending[pending_id]
+                if isinstance(r, Exception):
+                    fut.set_exception(r)
+                    fut.exception()  # kept in _done; don't warn about futures nobody awaited
+                else:
+                    fut.set_result(r)
+                self._done[pending_id] = r
+            while len(self._done) > self.keep_results:
+                self._done.popitem(last=False)
+
+
+class LedgerTail:
+    """
+    Fans committed entries out to asyncio subscribers (e.g. SSE streams).
+    Register publish() as a ledger listener; it may be called from any
+    thread. Each subscriber has a bounded queue: a subscriber that falls
+    behind is closed (its queue gets None) rather than slowing the append
+    path, and is expected to reconnect and catch up from the ledger.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        self._loop = None
+        self._subs = {}  # queue -> project_id (None = all projects)
+
+    def subscribe(self, project_id=None):
+        self._loop = asyncio.get_running_loop()
+        q = asyncio.Queue(self.maxsize)
+        self._subs[q] = project_id
+        return q
+
+    def unsubscribe(self, q):
+        self._subs.pop(q, None)
+
+    def publish(self, entries):
+        if self._subs and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._dispatch, entries)
+
+    def _dispatch(self, entries):
+        for q, project_id in list(self._subs.items()):
+            for e in entries:
+                if project_id is not None and e["project_id"] != project_id:
+                    continue
+                if q.full():
+                    del self._subs[q]
+                    q.get_nowait()  # make room for the close marker
+                    q.put_nowait(None)
+                    break
+                q.put_nowait(e)
@@ -0,0 +1,351 @@
+# ledger_file.py
+"""
+Append-only file backend for the ledger: the same hash chain as Ledger, kept
+in a flat log instead of SQLite.
+
+Record layout (little endian):
+    u32 body_len | u32 crc32(body) | body | u32 body_len
+    body = u64 idx | f64 timestamp | i64 project_id | u32 len(payload)
+           | u16 len(prev_hash) | u16 len(hash) | payload | prev_hash | hash
+           | u8 hash scheme (absent in records written before schemes: sha256)
+
+The trailing length lets readers walk the log backwards from the end. A
+sparse index (`<log>.idx`, one u64 idx | u64 offset pair every
+`index_every` records) lets readers seek without scanning from the start.
+"""
+import bisect
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:  # not POSIX: no cross-process locking
+    fcntl = None
+
+from ledger import SCHEME_IDS, _entry_hash, _entry_dict, _payload_meta, _payload_text
+
+_HEAD = struct.Struct("<II")
+_TRAIL = struct.Struct("<I")
+_BODY = struct.Struct("<QdqIHH")
+_INDEX = struct.Struct("<QQ")
+_NO_PROJECT = -(1 << 63)
+
+FSYNC_POLICIES = ("record", "batch", "interval")
+
+
+def _encode(idx, ts, payload, prev, h, scheme, project_id):
+    p, pv, hh = payload.encode("utf-8"), prev.encode("ascii"), h.encode("ascii")
+    body = _BODY.pack(idx, ts, _NO_PROJECT if project_id is None else project_id, len(p), len(pv), len(hh)) + p + pv + hh + bytes([scheme])
+    return _HEAD.pack(len(body), zlib.crc32(body)) + body + _TRAIL.pack(len(body))
+
+
+def _decode(buf, off):
+    """Decode the record at `off`; returns (row, next_offset) or None if it is torn or corrupt."""
+    if off + _HEAD.size > len(buf):
+        return None
+    n, crc = _HEAD.unpack_from(buf, off)
+    end = off + _HEAD.size + n + _TRAIL.size
+    if end > len(buf):
+        return None
+    body = bytes(buf[off + _HEAD.size:off + _HEAD.size + n])
+    if zlib.crc32(body) != crc or _TRAIL.unpack_from(buf, end - _TRAIL.size)[0] != n:
+        return None
+    idx, ts, project_id, lp, lpv, lh = _BODY.unpack_from(body)
+    o = _BODY.size
+    payload = body[o:o + lp].decode("utf-8")
+    prev = body[o + lp:o + lp + lpv].decode("ascii")
+    o += lp + lpv
+    h = body[o:o + lh].decode("ascii")
+    scheme = body[o + lh] if len(body) > o + lh else 1
+    return (idx, ts, payload, prev, h, scheme, None if project_id == _NO_PROJECT else project_id), end
+
+
+class FileLedger:
+    def __init__(self, path="equilix.ledger", fsync="batch", fsync_interval=1.0, index_every=256,
+                 hash_scheme="sha256"):
+        """
+        fsync: "record" syncs after every entry, "batch" once per
+        append_many() call, "interval" at most every `fsync_interval` seconds
+        (entries written in between survive a process crash but not power loss;
+        a background thread syncs them once writes stop). close() syncs.
+        """
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {FSYNC_POLICIES}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_interval = fsync_interval
+        self.index_every = index_every
+        self.hash_scheme = SCHEME_IDS[hash_scheme]
+        self._lock = threading.Lock()
+        self._listeners = []
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index_fd = os.open(path + ".idx", os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        self._index = []  # [(idx, offset)] sorted
+        self._size = 0
+        self._count = 0
+        self._tail = (0, "")
+        self._last_fsync = time.monotonic()
+        self._unsynced = False
+        with self._file_lock():
+            self._load_index()
+            self._catch_up(recover=True)
+        self._closed = threading.Event()
+        self._flusher = None
+        if fsync == "interval":
+            self._flusher = threading.Thread(target=self._flush_loop, name="ledger-fsync", daemon=True)
+            self._flusher.start()
+
+    def _flush_loop(self):
+        while not self._closed.wait(self.fsync_interval):
+            with self._lock:
+                if self._unsynced and not self._closed.is_set():
+                    os.fsync(self._fd)
+                    self._last_fsync, self._unsynced = time.monotonic(), False
+
+    def _file_lock(self):
+        return _FileLock(self._fd)
+
+    def _load_index(self):
+        size = os.fstat(self._fd).st_size
+        raw = os.pread(self._index_fd, os.fstat(self._index_fd).st_size, 0)
+        usable = len(raw) - len(raw) % _INDEX.size
+        # Several processes may have appended index points: sort and de-dup.
+        entries = sorted(set(_INDEX.iter_unpack(raw[:usable])))
+        # Keep only points at a record with the idx they claim: a point may
+        # predate a torn-tail truncation, and the log may since have grown
+        # past it with other records.
+        self._index = [e for e in entries if e[1] < size and self._record_idx_at(e[1]) == e[0]]
+        if len(self._index) != len(entries):
+            self._rewrite_index()
+        if self._index:
+            self._size = self._index[-1][1]
+            self._count = (len(self._index) - 1) * self.index_every
+
+    def _record_idx_at(self, offset):
+        """idx of the intact record at `offset`, or None."""
+        head = os.pread(self._fd, _HEAD.size, offset)
+        if len(head) < _HEAD.size:
+            return None
+        rec = _decode(os.pread(self._fd, _HEAD.size + _HEAD.unpack(head)[0] + _TRAIL.size, offset), 0)
+        return rec[0][0] if rec else None
+
+    def _rewrite_index(self):
+        os.ftruncate(self._index_fd, 0)
+        os.write(self._index_fd, b"".join(_INDEX.pack(*e) for e in self._index))
+
+    def _catch_up(self, recover=False):
+        """Scan records past the known end (written by us before a crash, or by another process)."""
+        size = os.fstat(self._fd).st_size
+        if size == self._size:
+            return
+        buf = os.pread(self._fd, size - self._size, self._size)
+        off = 0
+        while True:
+            rec = _decode(buf, off)
+            if rec is None:
+                break
+            row, nxt = rec
+            self._note_record(row[0], self._size + off)
+            self._tail = (row[0], row[4])
+            off = nxt
+        if off < len(buf):
+            if not recover:
+                raise IOError(f"corrupt ledger record at offset {self._size + off} in {self.path}")
+            os.ftruncate(self._fd, self._size + off)  # drop a torn tail left by a crash
+            # Index points into the dropped bytes would be wrong once new records land there.
+            kept = [e for e in self._index if e[1] < self._size + off]
+            if len(kept) != len(self._index):
+                self._index = kept
+                self._rewrite_index()
+        self._size += off
+
+    def _note_record(self, idx, offset):
+        if self._count % self.index_every == 0 and (not self._index or self._index[-1][1] < offset):
+            self._index.append((idx, offset))
+            os.write(self._index_fd, _INDEX.pack(idx, offset))
+        self._count += 1
+
+    def append(self, payload):
+        return self.append_many([payload])[0]
+
+    def append_many(self, payloads):
+        if not payloads:
+            return []
+        payloads = [_payload_text(p) for p in payloads]
+        with self._lock, self._file_lock():
+            if os.fstat(self._fd).st_size != self._size:
+                self._catch_up()
+            idx, prev = self._tail
+            chunks, hashes, offsets, rows = [], [], [], []
+            off = self._size
+            for payload in payloads:
+                idx += 1
+                ts = time.time()
+                h = _entry_hash(ts, payload, prev, self.hash_scheme)
+                project_id = _payload_meta(payload)[0]
+                rec = _encode(idx, ts, payload, prev, h, self.hash_scheme, project_id)
+                rows.append((idx, ts, payload, prev, h, self.hash_scheme, project_id))
+                chunks.append(rec)
+                offsets.append((idx, off))
+                hashes.append(h)
+                off += len(rec)
+                prev = h
+                if self.fsync == "record":
+                    os.write(self._fd, rec)
+                    os.fsync(self._fd)
+            if self.fsync != "record":
+                os.write(self._fd, b"".join(chunks))
+                now = time.monotonic()
+                if self.fsync == "batch" or now - self._last_fsync >= self.fsync_interval:
+                    os.fsync(self._fd)
+                    self._last_fsync, self._unsynced = now, False
+                else:
+                    self._unsynced = True
+            for i, o in offsets:
+                self._note_record(i, o)
+            self._size = off
+            self._tail = (idx, prev)
+        if self._listeners:
+            entries = [dict(_entry_dict(r), project_id=r[6]) for r in rows]
+            try:
+                for fn in self._listeners:
+                    fn(entries)
+            except Exception as e:  # the records are written; don't report a failed append
+                print("⚠️ ledger listener failed:", e)
+        return hashes
+
+    def add_listener(self, fn):
+        """Call fn(entries) with the entry dicts (plus project_id) of every batch this process commits."""
+        self._listeners.append(fn)
+
+    def close(self):
+        self._closed.set()
+        if self._flusher is not None:
+            self._flusher.join()
+        with self._lock:
+            os.fsync(self._fd)
+            os.close(self._fd)
+            os.close(self._index_fd)
+
+    # --- readers ---
+
+    def _map(self):
+        # flock belongs to the open file description: locking self._fd here
+        # would downgrade, then release, a writer's exclusive lock on it.
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            with _FileLock(fd, shared=True):  # size lands on a record boundary
+                size = os.fstat(fd).st_size
+            if size == 0:
+                return None
+            return mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)  # the mapping stays valid
+
+    def _offset_of(self, buf, idx):
+        """Offset of the first record with idx >= `idx` (len(buf) if none)."""
+        i = bisect.bisect_right(self._index, (idx, float("inf"))) - 1
+        off = self._index[i][1] if i >= 0 else 0
+        while off < len(buf):
+            rec = _decode(buf, off)
+            if rec is None or rec[0][0] >= idx:
+                break
+            off = rec[1]
+        return off
+
+    def _forward(self, buf, off):
+        while True:
+            rec = _decode(buf, off)
+            if rec is None:
+                return
+            yield rec[0]
+            off = rec[1]
+
+    def _backward(self, buf, end):
+        while end > 0:
+            n = _TRAIL.unpack_from(buf, end - _TRAIL.size)[0]
+            start = end - _TRAIL.size - n - _HEAD.size
+            rec = _decode(buf, start)
+            if rec is None:
+                return
+            yield rec[0]
+            end = start
+
+    def read_latest(self, limit:int=50, project_id:int=None, before_idx:int=None, after_idx:int=None,
+                    from_ts:float=None, to_ts:float=None):
+        buf = self._map()
+        if buf is None:
+            return []
+        try:
+            if after_idx is not None and before_idx is None:
+                rows = self._forward(buf, self._offset_of(buf, after_idx + 1))
+            else:
+                rows = self._backward(buf, self._offset_of(buf, before_idx) if before_idx is not None else len(buf))
+            out = []
+            for r in rows:
+                if len(out) >= limit:
+                    break
+                if (project_id is not None and r[6] != project_id) or (after_idx is not None and r[0] <= after_idx) or \
+                   (from_ts is not None and r[1] < from_ts) or (to_ts is not None and r[1] > to_ts):
+                    continue
+                out.append(_entry_dict(r))
+        finally:
+            buf.close()
+        if after_idx is not None and before_idx is None:
+            out.reverse()
+        return out
+
+    def iter_entries(self, project_id:int=None, after_idx:int=0, chunk:int=1000):
+        buf = self._map()
+        if buf is None:
+            return
+        try:
+            for r in self._forward(buf, self._offset_of(buf, after_idx + 1)):
+                if project_id is None or r[6] == project_id:
+                    yield _entry_dict(r)
+        finally:
+            buf.close()
+
+    def verify(self, full=True, chunk=None):
+        """Re-hash the whole log (this backend keeps no checkpoints)."""
+        buf = self._map()
+        prev, last_idx, checked = "", 0, 0
+        if buf is not None:
+            try:
+                off = 0
+                while off < len(buf):
+                    rec = _decode(buf, off)
+                    if rec is None:
+                        return {"ok": False, "from_idx": 0, "broken_at": last_idx + 1, "reason": "corrupt record"}
+                    (idx, ts, payload, prev_hash, h, scheme, _), off = rec
+                    if prev_hash != prev:
+                        return {"ok": False, "from_idx": 0, "broken_at": idx, "reason": "prev_hash does not match previous entry"}
+                    if _entry_hash(ts, payload, prev_hash, scheme) != h:
+                        return {"ok": False, "from_idx": 0, "broken_at": idx, "reason": "hash does not match entry contents"}
+                    prev, last_idx = h, idx
+                    checked += 1
+            finally:
+                buf.close()
+        return {"ok": True, "from_idx": 0, "to_idx": last_idx, "checked": checked}
+
+    def verify_full(self, workers=None):
+        return self.verify(full=True)
+
+
+class _FileLock:
+    """flock on the log: exclusive for appends so several processes write in turn, shared for readers."""
+    def __init__(self, fd, shared=False):
+        self.fd = fd
+        self.shared = shared
+
+    def __enter__(self):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+
+    def __exit__(self, *exc):
+        if fcntl:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
@@ -1,53 +1,95 @@
 # main.py
 import os
+import time
 import hashlib
 import json
-import sqlite3
+import asyncio
+import tarfile
+import zipfile
+import zlib
+from contextlib import asynccontextmanager
 from typing import List, Optional
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, Header, Query
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+import db
+import ingest
+import migrations
+import neardup
+import search
 from compliance import ComplianceEngine, generate_tests_via_llm
-from ledger import Ledger
-from models import ProjectCreate, IngestResponse, TestCaseOut
+from ledger import Ledger, AsyncLedgerWriter, LedgerTail
+from ledger_file import FileLedger
+from models import ProjectCreate, IngestResponse, BatchIngestResponse, TestCaseOut
 
 # CONFIG
 DB_PATH = os.environ.get("EQUILIX_DB", "equilix.db")
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")  # optional; used by LLM call if present
+LEDGER_GROUP_COMMIT = os.environ.get("EQUILIX_LEDGER_GROUP_COMMIT", "0") == "1"
+LEDGER_MAX_BATCH = int(os.environ.get("EQUILIX_LEDGER_MAX_BATCH", "64"))
+LEDGER_MAX_LINGER_MS = float(os.environ.get("EQUILIX_LEDGER_MAX_LINGER_MS", "2"))
+LEDGER_KEY = os.environ.get("EQUILIX_LEDGER_KEY")  # signs verification checkpoints
+LEDGER_MERKLE_EPOCH = int(os.environ.get("EQUILIX_LEDGER_MERKLE_EPOCH", "256"))
+LEDGER_SEGMENT_ROWS = int(os.environ.get("EQUILIX_LEDGER_SEGMENT_ROWS", "0")) or None  # seal every N entries
+LEDGER_BACKEND = os.environ.get("EQUILIX_LEDGER_BACKEND", "sqlite")  # "sqlite" or "file"
+LEDGER_LOG_PATH = os.environ.get("EQUILIX_LEDGER_LOG", "equilix.ledger")  # used by the "file" backend
+LEDGER_FSYNC = os.environ.get("EQUILIX_LEDGER_FSYNC", "batch")  # "record", "batch" or "interval"
+LEDGER_HASH = os.environ.get("EQUILIX_LEDGER_HASH", "sha256")  # hash scheme for new entries: "sha256" or "blake2b"
+LEDGER_SNAPSHOT_EVERY = int(os.environ.get("EQUILIX_LEDGER_SNAPSHOT_EVERY", "1000")) or None
+LEDGER_ASYNC = os.environ.get("EQUILIX_LEDGER_ASYNC", "0") == "1"  # don't wait for ledger commits in handlers
+INGEST_BATCH = int(os.environ.get("EQUILIX_INGEST_BATCH", "1000"))  # requirements inserted per transaction
+INGEST_SEGMENTER = os.environ.get("EQUILIX_INGEST_SEGMENTER", "paragraph")  # default segmenter: "paragraph" or "structured"
+INGEST_WORKERS = int(os.environ.get("EQUILIX_INGEST_WORKERS", "4"))  # threads parsing batch uploads
+DIFF_THRESHOLD = float(os.environ.get("EQUILIX_DIFF_THRESHOLD", "0.8"))  # similarity for "modified" in diff ingest
+NEARDUP_THRESHOLD = float(os.environ.get("EQUILIX_NEARDUP_THRESHOLD", str(neardup.THRESHOLD)))  # MinHash similarity to join a cluster
 
 # Initialize app, DB, services
-app = FastAPI(title="Equilix PoC API")
-ledger = Ledger(DB_PATH)
+if LEDGER_BACKEND == "file":
+    ledger = FileLedger(LEDGER_LOG_PATH, fsync=LEDGER_FSYNC, hash_scheme=LEDGER_HASH)
+else:
+    ledger = Ledger(DB_PATH, group_commit=LEDGER_GROUP_COMMIT,
+                    max_batch=LEDGER_MAX_BATCH, max_linger_ms=LEDGER_MAX_LINGER_MS, checkpoint_key=LEDGER_KEY,
+                    merkle_epoch=LEDGER_MERKLE_EPOCH, segment_rows=LEDGER_SEGMENT_ROWS, hash_scheme=LEDGER_HASH,
+                    snapshot_every=LEDGER_SNAPSHOT_EVERY)
+if LEDGER_BACKEND != "file" and not LEDGER_KEY:
+    print("⚠️ EQUILIX_LEDGER_KEY is not set: ledger checkpoints are disabled and every verify starts from genesis")
+ledger_writer = AsyncLedgerWriter(ledger) if LEDGER_ASYNC else None
+ledger_tail = LedgerTail()
+ledger.add_listener(ledger_tail.publish)
 engine = ComplianceEngine()
 
+@asynccontextmanager
+async def lifespan(app):
+    if ledger_writer:
+        await ledger_writer.start()
+    yield
+    if ledger_writer:
+        await ledger_writer.stop()
+    ledger.close()  # drain group commits / fsync the file backend
+    db.pool.close_all()
+
+app = FastAPI(title="Equilix PoC API", lifespan=lifespan)
+
+# --- Ledger helpers ---
+# In async mode these return a pending id (see /api/v1/audit/pending/{id})
+# instead of waiting for the commit; otherwise they return None once written.
+# Entries are passed as dicts so the ledger stores them in canonical JSON.
+def record(entry: dict) -> Optional[str]:
+    if ledger_writer and ledger_writer.running:
+        return ledger_writer.submit_threadsafe(entry)
+    ledger.append(entry)
+    return None
+
+async def record_async(entry: dict) -> Optional[str]:
+    if ledger_writer and ledger_writer.running:
+        return await ledger_writer.submit(entry)
+    await asyncio.to_thread(ledger.append, entry)
+    return None
+
 # --- DB helper (very small) ---
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS projects (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT,
-        region TEXT,
-        regulations TEXT
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS requirements (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER,
-        text TEXT
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS test_cases (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        project_id INTEGER,
-        requirement_id INTEGER,
-        title TEXT,
-        steps TEXT,
-        compliance_justification TEXT,
-        risk_score REAL
-    )""")
-    conn.commit()
-    conn.close()
+    with db.connect(DB_PATH) as conn:
+        migrations.migrate(conn)
 
 init_db()
 
@@ -55,96 +97,279 @@ init_db()
 
 @app.post("/api/v1/projects", response_model=dict)
 def create_project(p: ProjectCreate):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    regs_json = json.dumps(p.regulations)
-    cur.execute("INSERT INTO projects (name, region, regulations) VALUES (?, ?, ?)",
-                (p.name, p.region, regs_json))
-    project_id = cur.lastrowid
-    conn.commit()
-    conn.close()
+    with db.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        regs_json = json.dumps(p.regulations)
+        cur.execute("INSERT INTO projects (name, region, regulations) VALUES (?, ?, ?)",
+                    (p.name, p.region, regs_json))
+        project_id = cur.lastrowid
+        conn.commit()
     return {"project_id": project_id, "name": p.name, "region": p.region, "regulations": p.regulations}
 
+def _upsert_requirements(cur, project_id: int, hashes: List[str], segments: List[ingest.Segment]) -> List[tuple]:
+    """
+    Return (requirement_id, is_new) for each segment (unique by hash): known
+    hashes map to their stored row, which is reactivated if it had been
+    removed or superseded; the rest are bulk inserted and clustered with
+    their near duplicates. Caller holds the write transaction.
+    """
+    existing = {}
+    for i in range(0, len(hashes), 500):
+        part = hashes[i:i + 500]
+        existing.update((h, (rid, status)) for h, rid, status in cur.execute(
+            f"SELECT content_hash, id, status FROM requirements WHERE project_id = ? AND content_hash IN ({','.join('?' * len(part))})",
+            (project_id, *part)))
+    revived = [(rid,) for rid, status in existing.values() if status != "active"]
+    if revived:
+        cur.executemany("UPDATE requirements SET status = 'active', superseded_by = NULL WHERE id = ?", revived)
+        cur.executemany("UPDATE test_cases SET stale = 0 WHERE requirement_id = ?", revived)
+    new = [(h, s) for h, s in zip(hashes, segments) if h not in existing]
+    ids = db.insert_many(cur, """INSERT INTO requirements (project_id, text, content_hash, spec_ref, section_path)
+                                VALUES (?, ?, ?, ?, ?)""",
+                         [(project_id, s.text, h, s.spec_ref, s.section_path) for h, s in new])
+    neardup.assign_clusters(cur, project_id, [(rid, s.text) for rid, (_, s) in zip(ids, new)], NEARDUP_THRESHOLD)
+    ids = iter(ids)
+    return [(existing[h][0], False) if h in existing else (next(ids), True) for h in hashes]
+
+def _insert_requirements(project_id: int, segments: List[ingest.Segment]) -> List[tuple]:
+    """
+    Insert the requirements the project does not have yet (by content hash)
+    and return (requirement_id, is_new) for every segment, in order.
+    """
+    hashes = [ingest.content_hash(s.text) for s in segments]
+    firsts = {}  # first segment per hash, in upload order
+    for h, s in zip(hashes, segments):
+        firsts.setdefault(h, s)
+    with db.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")  # no other writer between the lookup and the insert
+        stored = dict(zip(firsts, _upsert_requirements(cur, project_id, list(firsts), list(firsts.values()))))
+        conn.commit()
+    out = []
+    for h in hashes:
+        out.append(stored[h])
+        stored[h] = (stored[h][0], False)  # later copies in this upload are duplicates
+    return out
+
+def _diff_requirements(project_id: int, segments: List[ingest.Segment]) -> dict:
+    """
+    Apply a new spec version: unchanged requirements stay, removed ones are
+    marked removed, modified ones superseded by a new requirement, and the
+    tests of removed/modified requirements are flagged stale.
+    """
+    with db.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        stored = cur.execute("SELECT id, content_hash, text FROM requirements WHERE project_id = ? AND status = 'active'",
+                             (project_id,)).fetchall()
+        d = ingest.diff_requirements(stored, [s.text for s in segments], threshold=DIFF_THRESHOLD)
+        by_text = {s.text: s for s in segments}
+        texts = d["added"] + [t for _, t, _ in d["modified"]]
+        rows = _upsert_requirements(cur, project_id, [ingest.content_hash(t) for t in texts], [by_text[t] for t in texts])
+        ids = [rid for rid, _ in rows]
+        added_ids, modified_ids = ids[:len(d["added"])], ids[len(d["added"]):]
+        superseded = [(new, old) for (old, _, _), new in zip(d["modified"], modified_ids)]
+        cur.executemany("UPDATE requirements SET status = 'removed' WHERE id = ?", [(rid,) for rid in d["removed"]])
+        cur.executemany("UPDATE requirements SET status = 'superseded', superseded_by = ? WHERE id = ?", superseded)
+        cur.executemany("UPDATE test_cases SET stale = 1 WHERE requirement_id = ? AND stale = 0",
+                        [(rid,) for rid in d["removed"]] + [(old,) for _, old in superseded])
+        stale_tests = cur.rowcount
+        now = time.time()
+        cur.executemany("""INSERT INTO requirement_changes (project_id, change, requirement_id, previous_id, similarity, created_at)
+                           VALUES (?, ?, ?, ?, ?, ?)""",
+                        [(project_id, "added", rid, None, None, now) for rid in added_ids] +
+                        [(project_id, "removed", None, rid, None, now) for rid in d["removed"]] +
+                        [(project_id, "modified", new, old, sim, now) for (old, _, sim), new in zip(d["modified"], modified_ids)])
+        conn.commit()
+    return {
+        "unchanged": len(d["unchanged"]),
+        "added": [{"requirement_id": rid, "text": t} for rid, t in zip(added_ids, d["added"])],
+        "removed": d["removed"],
+        "modified": [{"requirement_id": new, "previous_id": old, "similarity": sim, "text": t}
+                     for (old, t, sim), new in zip(d["modified"], modified_ids)],
+        "stale_tests": max(stale_tests, 0),
+    }
+
+def _segmenter_name(name: Optional[str]) -> str:
+    name = name or INGEST_SEGMENTER
+    if name not in ingest.SEGMENTERS:
+        raise HTTPException(status_code=400, detail=f"segmenter must be one of {sorted(ingest.SEGMENTERS)}")
+    return name
+
+def _requirement_out(rid: int, s: ingest.Segment, is_new: bool) -> dict:
+    out = {"requirement_id": rid, "text": s.text, "new": is_new}
+    if s.spec_ref:
+        out["spec_ref"] = s.spec_ref
+    if s.section_path:
+        out["section_path"] = s.section_path
+    return out
+
 @app.post("/api/v1/projects/{project_id}/ingest", response_model=IngestResponse)
-async def ingest_requirements(project_id: int, file: Optional[UploadFile] = File(None), text: Optional[str] = None):
+async def ingest_requirements(project_id: int, file: Optional[UploadFile] = File(None), text: Optional[str] = None,
+                              echo: bool = True, mode: str = "append", segmenter: Optional[str] = None):
+    """
+    Segments of the document become requirements: paragraphs by default,
+    or with segmenter=structured, requirement IDs / numbered items under
+    their Markdown or numbered headings (see ingest.py). Uploads are read
+    and split in chunks and inserted INGEST_BATCH at a time, one transaction
+    per batch, so memory stays flat for large documents; pass echo=false to
+    also leave the requirement texts out of the response. If the upload
+    fails part way, batches already inserted remain. Paragraphs the project
+    already has (same normalized content hash) are not inserted again; the
+    response marks each requirement new or existing.
+
+    mode=diff treats the document as the new version of the whole spec:
+    see _diff_requirements(). It needs every segment before diffing, so
+    it is applied in one transaction rather than in batches, and a
+    document with no segments is rejected.
+    """
     if not (file or text):
         raise HTTPException(status_code=400, detail="Provide either a file or raw text in 'text' param.")
-    content = ""
+    if mode not in ("append", "diff"):
+        raise HTTPException(status_code=400, detail="mode must be 'append' or 'diff'")
+    segmenter = _segmenter_name(segmenter)
+    with db.connect(DB_PATH) as conn:
+        if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
+            raise HTTPException(status_code=404, detail="Project not found")
+
+    if mode == "diff":
+        if file:
+            segments = [s async for s in ingest.iter_segments(file, segmenter)]
+        else:
+            segments = list(ingest.make_segmenter(segmenter).split(text))
+        if not segments:
+            # An empty new version would remove every requirement and stale every test.
+            raise HTTPException(status_code=400, detail="Diff upload contains no requirements")
+        changes = await asyncio.to_thread(_diff_requirements, project_id, segments)  # up to max_pairs difflib ratios
+        new = len(changes["added"]) + len(changes["modified"])
+        pending_id = await record_async({"action": "ingest", "project_id": project_id, "mode": "diff",
+                                         "count": len(segments), "new": new, "added": len(changes["added"]),
+                                         "removed": len(changes["removed"]), "modified": len(changes["modified"])})
+        if not echo:
+            changes["added"] = [{"requirement_id": a["requirement_id"]} for a in changes["added"]]
+            changes["modified"] = [{k: v for k, v in m.items() if k != "text"} for m in changes["modified"]]
+        return {"project_id": project_id, "ingested": len(segments), "new": new, "existing": changes["unchanged"],
+                "requirements": [], "changes": changes, "ledger_pending_id": pending_id}
+
+    count, new, inserted, batch = 0, 0, [], []
+
+    def flush():
+        nonlocal count, new
+        rows = _insert_requirements(project_id, batch)
+        count += len(rows)
+        new += sum(is_new for _, is_new in rows)
+        if echo:
+            inserted.extend(_requirement_out(rid, s, is_new) for (rid, is_new), s in zip(rows, batch))
+        batch.clear()
+
     if file:
-        b = await file.read()
-        try:
-            content = b.decode("utf-8")
-        except:
-            content = str(b)
+        async for s in ingest.iter_segments(file, segmenter):
+            batch.append(s)
+            if len(batch) >= INGEST_BATCH:
+                await asyncio.to_thread(flush)  # DB writes and clustering stay off the event loop
     else:
-        content = text
-
-    # Naive split by newline paragraphs as demo "requirements"
-    reqs = [r.strip() for r in content.split("\n\n") if r.strip()]
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    inserted = []
-    for r in reqs:
-        cur.execute("INSERT INTO requirements (project_id, text) VALUES (?, ?)", (project_id, r))
-        rid = cur.lastrowid
-        inserted.append({"requirement_id": rid, "text": r})
-    conn.commit()
-    conn.close()
+        batch.extend(ingest.make_segmenter(segmenter).split(text))
+    if batch:
+        await asyncio.to_thread(flush)
     # Write to immutable ledger (demo)
-    ledger_entry = {"action": "ingest", "project_id": project_id, "count": len(inserted)}
-    ledger.append(json.dumps(ledger_entry))
-    return {"project_id": project_id, "ingested": len(inserted), "requirements": inserted}
+    ledger_entry = {"action": "ingest", "project_id": project_id, "count": count, "new": new}
+    pending_id = await record_async(ledger_entry)
+    return {"project_id": project_id, "ingested": count, "new": new, "existing": count - new,
+            "requirements": inserted, "ledger_pending_id": pending_id}
+
+@app.post("/api/v1/projects/{project_id}/ingest/batch", response_model=BatchIngestResponse)
+async def ingest_batch(project_id: int, files: List[UploadFile] = File(...), echo: bool = True,
+                       segmenter: Optional[str] = None):
+    """
+    Ingest several documents at once: plain files and/or .zip / .tar(.gz,
+    .bz2, .xz) bundles, whose text members are decompressed in memory as
+    they are read. Documents are parsed on INGEST_WORKERS threads, then all
+    requirements are committed in one transaction with one ledger entry.
+    """
+    with db.connect(DB_PATH) as conn:
+        if not conn.execute("SELECT 1 FROM projects WHERE id = ?", (project_id,)).fetchone():
+            raise HTTPException(status_code=404, detail="Project not found")
+    segmenter = _segmenter_name(segmenter)
+    try:
+        docs, skipped = await asyncio.to_thread(ingest.parse_documents, [(f.filename, f.file) for f in files],
+                                                INGEST_WORKERS, segmenter)
+    except (zipfile.BadZipFile, tarfile.TarError, ValueError) as e:
+        raise HTTPException(status_code=400, detail=f"Could not read upload: {e}")
+    segments = [s for _, doc in docs for s in doc]
+    rows = await asyncio.to_thread(_insert_requirements, project_id, segments)
+    new = sum(is_new for _, is_new in rows)
+    pending_id = await record_async({"action": "ingest", "project_id": project_id, "mode": "batch",
+                                     "files": len(docs), "count": len(rows), "new": new})
+    inserted = [_requirement_out(rid, s, is_new) for (rid, is_new), s in zip(rows, segments)] if echo else []
+    return {"project_id": project_id, "documents": [{"name": name, "segments": len(doc)} for name, doc in docs],
+            "skipped": skipped, "ingested": len(rows), "new": new, "existing": len(rows) - new,
+            "requirements": inserted, "ledger_pending_id": pending_id}
 
 @app.post("/api/v1/projects/{project_id}/generate", response_model=dict)
-def generate_tests(project_id: int, prioritize_top:int = 10):
+def generate_tests(project_id: int, prioritize_top:int = 10, pending_only: bool = False, per_cluster: bool = True):
     """
-    Generate tests for all requirements in a project.
+    Generate tests for all active requirements in a project (with
+    pending_only, just those without any non-stale test, e.g. after a diff
+    ingest).
     This function:
       - loads requirements
-      - calls a mock LLM generator (or real LLM if OPENAI_API_KEY is set)
+      - calls a mock LLM generator (or real LLM if OPENAI_API_KEY is set),
+        once per near-duplicate cluster unless per_cluster is false; every
+        member gets the cluster's tests
       - runs compliance engine to attach justifications and risk score
       - stores results and writes ledger entry
     """
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, text FROM requirements WHERE project_id = ?", (project_id,))
-    rows = cur.fetchall()
-    if not rows:
-        raise HTTPException(status_code=404, detail="No requirements found for project")
-    generated = []
-    for (rid, rtext) in rows:
-        tests = generate_tests_via_llm(rtext, OPENAI_API_KEY)  # list of dicts: title, steps
+    with db.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        sql = "SELECT id, text, COALESCE(cluster_id, id) FROM requirements WHERE project_id = ? AND status = 'active'"
+        if pending_only:
+            sql += " AND NOT EXISTS (SELECT 1 FROM test_cases t WHERE t.requirement_id = requirements.id AND t.stale = 0)"
+        cur.execute(sql + " ORDER BY id", (project_id,))
+        rows = cur.fetchall()
+        if not rows:
+            if pending_only:
+                return {"project_id": project_id, "generated": [], "llm_calls": 0, "ledger_pending_id": None}
+            raise HTTPException(status_code=404, detail="No requirements found for project")
+    # Generate everything first so the write transaction (and the database
+    # write lock) is not held across LLM calls.
+    llm_tests = {}  # cluster (or requirement) -> generated tests, from its first requirement's text
+    generated, params = [], []
+    for (rid, rtext, cluster) in rows:
+        key = cluster if per_cluster else rid
+        if key not in llm_tests:
+            llm_tests[key] = generate_tests_via_llm(rtext, OPENAI_API_KEY)  # list of dicts: title, steps
         # run compliance engine to annotate
         annotated = []
-        for t in tests:
+        for t in llm_tests[key]:
             justification, risk = engine.assess_test_and_justify(rtext, t)
-            # persist
-            cur.execute("""INSERT INTO test_cases 
-                        (project_id, requirement_id, title, steps, compliance_justification, risk_score)
-                        VALUES (?, ?, ?, ?, ?, ?)""",
-                        (project_id, rid, t["title"], json.dumps(t["steps"]), json.dumps(justification), risk))
-            tid = cur.lastrowid
+            params.append((project_id, rid, t["title"], json.dumps(t["steps"]), json.dumps(justification), risk))
             annotated.append({
-                "test_id": tid,
                 "title": t["title"],
                 "steps": t["steps"],
                 "justification": justification,
                 "risk_score": risk
             })
-        generated.append({"requirement_id": rid, "tests": annotated})
-    conn.commit()
-    conn.close()
-    ledger.append(json.dumps({"action":"generate", "project_id": project_id, "generated_count": len(generated)}))
-    return {"project_id": project_id, "generated": generated}
+        generated.append({"requirement_id": rid, "cluster_id": cluster, "tests": annotated})
+    # persist in one batch
+    with db.connect(DB_PATH) as conn:
+        ids = db.insert_many(conn.cursor(), """INSERT INTO test_cases
+                             (project_id, requirement_id, title, steps, compliance_justification, risk_score)
+                             VALUES (?, ?, ?, ?, ?, ?)""", params)
+        conn.commit()
+    ids = iter(ids)
+    for g in generated:
+        g["tests"] = [dict(test_id=next(ids), **t) for t in g["tests"]]
+    pending_id = record({"action":"generate", "project_id": project_id, "generated_count": len(generated),
+                         "llm_calls": len(llm_tests)})
+    return {"project_id": project_id, "generated": generated, "llm_calls": len(llm_tests), "ledger_pending_id": pending_id}
 
 @app.get("/api/v1/projects/{project_id}/tests", response_model=List[TestCaseOut])
 def get_tests(project_id: int, regulation: Optional[str] = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""SELECT id, requirement_id, title, steps, compliance_justification, risk_score 
-                   FROM test_cases WHERE project_id = ?""", (project_id,))
-    rows = cur.fetchall()
-    conn.close()
+    with db.connect(DB_PATH) as conn:
+        cur = conn.cursor()
+        cur.execute("""SELECT id, requirement_id, title, steps, compliance_justification, risk_score, stale
+                       FROM test_cases WHERE project_id = ?""", (project_id,))
+        rows = cur.fetchall()
     out = []
     for r in rows:
         out.append({
@@ -153,33 +378,184 @@ def get_tests(project_id: int, regulation: Optional[str] = None):
             "title": r[2],
             "steps": json.loads(r[3]),
             "compliance_justification": json.loads(r[4]),
-            "risk_score": r[5]
+            "risk_score": r[5],
+            "stale": bool(r[6])
         })
     return out
 
+@app.get("/api/v1/projects/{project_id}/search", response_model=dict)
+def search_project(project_id: int, q: str, kind: Optional[str] = None, limit: int = 20):
+    """
+    Ranked full-text search over the project's requirements and test cases,
+    with highlighted snippets (see search.py). kind=requirement or
+    kind=test_case restricts the search to one of them.
+    """
+    try:
+        with db.connect(DB_PATH) as conn:
+            results = search.search(conn, project_id, q, kind=kind, limit=limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {"project_id": project_id, "query": q, "results": results}
+
+@app.get("/api/v1/projects/{project_id}/clusters", response_model=dict)
+def get_clusters(project_id: int, min_size: int = 2, limit: int = 50):
+    """
+    Near-duplicate clusters of the project's active requirements, largest
+    first. Members list the MinHash similarity that put them in the
+    cluster (None for the requirement that started it).
+    """
+    with db.connect(DB_PATH) as conn:
+        found, total = neardup.clusters(conn, project_id, min_size=max(min_size, 1), limit=max(1, min(limit, 500)))
+    return {"project_id": project_id, "threshold": NEARDUP_THRESHOLD, "total": total, "clusters": found}
+
 @app.post("/api/v1/tests/{test_id}/approve", response_model=dict)
 def approve_test(test_id: int, approver: str = "qa"):
     # Very small demonstration: write approval to ledger and return
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT id, project_id FROM test_cases WHERE id = ?", (test_id,))
-    row = cur.fetchone()
+    with db.connect(DB_PATH) as conn:
+        row = conn.execute("SELECT id, project_id FROM test_cases WHERE id = ?", (test_id,)).fetchone()
     if not row:
         raise HTTPException(status_code=404, detail="Test not found")
     project_id = row[1]
-    ledger.append(json.dumps({"action":"approve_test", "project_id": project_id, "test_id": test_id, "approver": approver}))
-    return {"test_id": test_id, "status": "approved", "approver": approver}
+    pending_id = record({"action":"approve_test", "project_id": project_id, "test_id": test_id, "approver": approver})
+    return {"test_id": test_id, "status": "approved", "approver": approver, "ledger_pending_id": pending_id}
 
 @app.get("/api/v1/audit/{project_id}/ledger", response_model=dict)
-def get_ledger(project_id: int, limit: int = 50):
-    entries = ledger.read_latest(limit=limit)
-    # filter by project_id if present in entry json
-    filtered = []
-    for e in entries:
+def get_ledger(project_id: int, limit: int = Query(50, ge=1, le=1000), before_idx: Optional[int] = None, after_idx: Optional[int] = None,
+               from_ts: Optional[float] = None, to_ts: Optional[float] = None):
+    entries = ledger.read_latest(limit=limit, project_id=project_id, before_idx=before_idx, after_idx=after_idx,
+                                 from_ts=from_ts, to_ts=to_ts)
+    return {
+        "project_id": project_id,
+        "ledger": entries,
+        # keyset cursors: pass back as before_idx (older page) / after_idx (newer page)
+        "next_before_idx": entries[-1]["idx"] if len(entries) == limit else None,
+        "next_after_idx": entries[0]["idx"] if entries else after_idx,
+    }
+
+@app.get("/api/v1/audit/{project_id}/state", response_model=dict)
+def get_project_state(project_id: int):
+    """Ingest/generation counters and approved tests derived from the ledger (snapshot + tail replay)."""
+    return dict(_ledger_feature("project_state")(project_id), project_id=project_id)
+
+@app.get("/api/v1/audit/{project_id}/stream")
+async def stream_ledger(project_id: int, after_idx: Optional[int] = None, last_event_id: Optional[str] = Header(None)):
+    """
+    Server-Sent Events feed of the project's ledger entries as they are
+    committed by this process. Reconnecting clients (Last-Event-ID, or
+    after_idx) first get the entries they missed.
+    """
+    if last_event_id and last_event_id.isdigit():
+        after_idx = int(last_event_id)
+
+    def event(e):
+        e = {k: v for k, v in e.items() if k != "project_id"}
+        return f"id: {e['idx']}\nevent: ledger\ndata: {json.dumps(e)}\n\n"
+
+    async def events():
+        sub = ledger_tail.subscribe(project_id)  # before the backlog read, so nothing falls in between
         try:
-            payload = json.loads(e["payload"])
-            if payload.get("project_id") == project_id:
-                filtered.append(e)
-        except:
-            continue
-    return {"project_id": project_id, "ledger": filtered}
+            last = after_idx or 0
+            if after_idx is not None:
+                while True:
+                    backlog = await asyncio.to_thread(ledger.read_latest, limit=500, project_id=project_id, after_idx=last)
+                    for e in reversed(backlog):
+                        yield event(e)
+                        last = e["idx"]
+                    if len(backlog) < 500:
+                        break
+            while True:
+                try:
+                    e = await asyncio.wait_for(sub.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                if e is None:  # fell behind; the client reconnects with Last-Event-ID
+                    return
+                if e["idx"] > last:
+                    last = e["idx"]
+                    yield event(e)
+        finally:
+            ledger_tail.unsubscribe(sub)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.get("/api/v1/audit/pending/{pending_id}", response_model=dict)
+async def ledger_pending(pending_id: str):
+    """
+    Durability barrier: returns once the pending ledger entry is committed,
+    or 503 if it could not be (after the writer's retries).
+    """
+    if not (ledger_writer and ledger_writer.running):
+        raise HTTPException(status_code=404, detail="Async ledger writes are not enabled")
+    try:
+        h = await ledger_writer.wait(pending_id)
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Ledger entry was not recorded: {e}")
+    if h is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired pending id (ids are only valid on the worker that issued them)")
+    return {"pending_id": pending_id, "hash": h}
+
+@app.get("/api/v1/db/stats", response_model=dict)
+def db_stats():
+    """Connection pool counters: connections opened vs reused, leftover transactions rolled back."""
+    return db.pool.stats()
+
+@app.get("/api/v1/audit/verify", response_model=dict)
+def verify_ledger(full: bool = False, workers: int = Query(1, ge=1)):
+    """
+    Verify the ledger hash chain incrementally from the last signed
+    checkpoint. With full, `workers` > 1 re-hashes in parallel on up to
+    that many processes (capped at the number of CPUs).
+    """
+    if full and workers > 1:
+        return ledger.verify_full(workers=workers)
+    return ledger.verify(full=full)
+
+def _ledger_feature(name):
+    fn = getattr(ledger, name, None)
+    if fn is None:
+        raise HTTPException(status_code=501, detail=f"Not supported by the '{LEDGER_BACKEND}' ledger backend")
+    return fn
+
+@app.get("/api/v1/audit/merkle/root", response_model=dict)
+def merkle_root():
+    return _ledger_feature("merkle_root")()
+
+@app.get("/api/v1/audit/merkle/proof/{idx}", response_model=dict)
+def merkle_proof(idx: int):
+    """Inclusion proof for one ledger entry; check it with Ledger.verify_inclusion."""
+    proof = _ledger_feature("merkle_proof")(idx)
+    if proof is None:
+        raise HTTPException(status_code=404, detail="Ledger entry not found")
+    return proof
+
+@app.get("/api/v1/audit/export")
+def export_ledger(project_id: Optional[int] = None, after_idx: int = 0, gzip: bool = False):
+    """Stream the ledger (optionally one project's entries) as NDJSON, oldest first."""
+    def ndjson():
+        buf = []
+        size = 0
+        for e in ledger.iter_entries(project_id=project_id, after_idx=after_idx):
+            line = json.dumps(e) + "\n"
+            buf.append(line)
+            size += len(line)
+            if size >= 65536:
+                yield "".join(buf).encode("utf-8")
+                buf, size = [], 0
+        if buf:
+            yield "".join(buf).encode("utf-8")
+
+    def gzipped():
+        z = zlib.compressobj(wbits=31)  # gzip container
+        for block in ndjson():
+            out = z.compress(block)
+            if out:
+                yield out
+        yield z.flush()
+
+    name = f"ledger-{project_id}" if project_id is not None else "ledger"
+    if gzip:
+        return StreamingResponse(gzipped(), media_type="application/gzip",
+                                 headers={"Content-Disposition": f'attachment; filename="{name}.ndjson.gz"'})
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": f'attachment; filename="{name}.ndjson"'})
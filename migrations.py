@@ -0,0 +1,238 @@
+# migrations.py
+"""
+Versioned schema migrations for the application tables (projects,
+requirements, test_cases). The ledger manages its own tables in ledger.py.
+
+`schema_version` records every step applied. At startup migrate() runs the
+pending steps in order, one transaction each, so a failed step leaves the
+database at the previous version. Add new steps at the end of MIGRATIONS;
+never edit or reorder applied ones. A step that rebuilds requirements or
+test_cases must recreate their *_fts_* triggers.
+"""
+import time
+
+import neardup
+from ingest import content_hash
+
+
+def _create_tables(cur):
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS projects (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT,
+        region TEXT,
+        regulations TEXT
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS requirements (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER,
+        text TEXT
+    )""")
+    cur.execute("""
+    CREATE TABLE IF NOT EXISTS test_cases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER,
+        requirement_id INTEGER,
+        title TEXT,
+        steps TEXT,
+        compliance_justification TEXT,
+        risk_score REAL
+    )""")
+
+
+def _add_indexes(cur):
+    cur.execute("CREATE INDEX IF NOT EXISTS requirements_project_idx ON requirements(project_id)")
+    # get_tests filters by project; risk_score lets the same index serve risk-ordered listings.
+    cur.execute("CREATE INDEX IF NOT EXISTS test_cases_project_risk_idx ON test_cases(project_id, risk_score)")
+    cur.execute("CREATE INDEX IF NOT EXISTS test_cases_requirement_idx ON test_cases(requirement_id)")
+
+
+def _add_foreign_keys(cur):
+    """
+    SQLite cannot add a constraint to an existing table, so rebuild both
+    tables with REFERENCES clauses and copy the rows across. Rows that
+    already point at missing parents are kept as they are: enforcement
+    applies to new writes.
+    """
+    cur.execute("""
+    CREATE TABLE requirements_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+        text TEXT
+    )""")
+    cur.execute("INSERT INTO requirements_new (id, project_id, text) SELECT id, project_id, text FROM requirements")
+    cur.execute("""
+    CREATE TABLE test_cases_new (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+        requirement_id INTEGER REFERENCES requirements(id) ON DELETE CASCADE,
+        title TEXT,
+        steps TEXT,
+        compliance_justification TEXT,
+        risk_score REAL
+    )""")
+    cur.execute("""INSERT INTO test_cases_new
+                   (id, project_id, requirement_id, title, steps, compliance_justification, risk_score)
+                   SELECT id, project_id, requirement_id, title, steps, compliance_justification, risk_score
+                   FROM test_cases""")
+    cur.execute("DROP TABLE test_cases")
+    cur.execute("DROP TABLE requirements")
+    cur.execute("ALTER TABLE requirements_new RENAME TO requirements")
+    cur.execute("ALTER TABLE test_cases_new RENAME TO test_cases")
+    _add_indexes(cur)  # dropped with the old tables
+
+
+def _add_content_hash(cur):
+    """
+    Requirements get a normalized content hash, unique per project, so
+    ingest can skip paragraphs it already has. Existing duplicates keep
+    their rows (tests may point at them); only the oldest copy gets the
+    hash, the rest stay NULL and are ignored by the unique index.
+    """
+    cur.execute("ALTER TABLE requirements ADD COLUMN content_hash TEXT")
+    seen, updates = set(), []
+    for rid, project_id, text in cur.execute("SELECT id, project_id, text FROM requirements ORDER BY id").fetchall():
+        key = (project_id, content_hash(text or ""))
+        if key not in seen:
+            seen.add(key)
+            updates.append((key[1], rid))
+    cur.executemany("UPDATE requirements SET content_hash = ? WHERE id = ?", updates)
+    cur.execute("CREATE UNIQUE INDEX requirements_content_idx ON requirements(project_id, content_hash)")
+
+
+def _add_requirement_lifecycle(cur):
+    """
+    Diff re-ingest: requirements become active, removed or superseded (by
+    the requirement that modified them), tests of changed requirements are
+    flagged stale, and every change is logged.
+    """
+    cur.execute("ALTER TABLE requirements ADD COLUMN status TEXT NOT NULL DEFAULT 'active'")
+    cur.execute("ALTER TABLE requirements ADD COLUMN superseded_by INTEGER REFERENCES requirements(id)")
+    cur.execute("ALTER TABLE test_cases ADD COLUMN stale INTEGER NOT NULL DEFAULT 0")
+    cur.execute("""
+    CREATE TABLE requirement_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+        change TEXT,
+        requirement_id INTEGER,
+        previous_id INTEGER,
+        similarity REAL,
+        created_at REAL
+    )""")
+    cur.execute("CREATE INDEX requirement_changes_project_idx ON requirement_changes(project_id, id)")
+
+
+def _add_spec_refs(cur):
+    """Where a requirement came from in its spec: its own ID/number and the headings above it."""
+    cur.execute("ALTER TABLE requirements ADD COLUMN spec_ref TEXT")
+    cur.execute("ALTER TABLE requirements ADD COLUMN section_path TEXT")
+    cur.execute("CREATE INDEX requirements_spec_ref_idx ON requirements(project_id, spec_ref)")
+
+
+def _add_search_index(cur):
+    """
+    FTS5 indexes over requirement text and test case title/steps. They use
+    the tables themselves as external content (text is stored once) and are
+    kept in sync by triggers.
+    """
+    cur.execute("""CREATE VIRTUAL TABLE requirements_fts USING fts5(
+                   text, content='requirements', content_rowid='id', tokenize='porter unicode61')""")
+    cur.execute("""CREATE VIRTUAL TABLE test_cases_fts USING fts5(
+                   title, steps, content='test_cases', content_rowid='id', tokenize='porter unicode61')""")
+    for table, cols in (("requirements", ("text",)), ("test_cases", ("title", "steps"))):
+        names = ", ".join(cols)
+        new = ", ".join(f"new.{c}" for c in cols)
+        old = ", ".join(f"old.{c}" for c in cols)
+        cur.execute(f"""CREATE TRIGGER {table}_fts_insert AFTER INSERT ON {table} BEGIN
+                        INSERT INTO {table}_fts (rowid, {names}) VALUES (new.id, {new});
+                        END""")
+        cur.execute(f"""CREATE TRIGGER {table}_fts_delete AFTER DELETE ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+                        END""")
+        cur.execute(f"""CREATE TRIGGER {table}_fts_update AFTER UPDATE OF {names} ON {table} BEGIN
+                        INSERT INTO {table}_fts ({table}_fts, rowid, {names}) VALUES ('delete', old.id, {old});
+                        INSERT INTO {table}_fts (rowid, {names}) VALUES (new.id, {new});
+                        END""")
+        cur.execute(f"INSERT INTO {table}_fts ({table}_fts) VALUES ('rebuild')")
+    cur.execute("INSERT INTO test_cases_fts (test_cases_fts, rank) VALUES ('rank', 'bm25(2.0, 1.0)')")  # titles count double
+
+
+def _add_near_duplicates(cur):
+    """
+    MinHash signatures, LSH buckets and near-duplicate clusters (see
+    neardup.py). Existing requirements are clustered in id order, as if
+    they had been ingested with this step in place.
+    """
+    cur.execute("ALTER TABLE requirements ADD COLUMN minhash BLOB")
+    cur.execute("ALTER TABLE requirements ADD COLUMN cluster_id INTEGER")
+    cur.execute("ALTER TABLE requirements ADD COLUMN cluster_similarity REAL")
+    cur.execute("""
+    CREATE TABLE requirement_lsh (
+        project_id INTEGER REFERENCES projects(id) ON DELETE CASCADE,
+        bucket INTEGER,
+        requirement_id INTEGER,
+        PRIMARY KEY (project_id, bucket, requirement_id)
+    ) WITHOUT ROWID""")
+    cur.execute("CREATE INDEX requirements_cluster_idx ON requirements(project_id, cluster_id)")
+    projects = [p for (p,) in cur.execute("SELECT DISTINCT project_id FROM requirements").fetchall()]
+    for project_id in projects:
+        rows = cur.execute("SELECT id, text FROM requirements WHERE project_id IS ? ORDER BY id", (project_id,)).fetchall()
+        neardup.assign_clusters(cur, project_id, [(rid, text or "") for rid, text in rows])
+
+
+# (version, description, step). Step 1 is what init_db() used to create, so
+# databases from before versioning start from there.
+MIGRATIONS = [
+    (1, "base tables", _create_tables),
+    (2, "project/requirement indexes", _add_indexes),
+    (3, "foreign keys to projects and requirements", _add_foreign_keys),
+    (4, "requirement content hashes", _add_content_hash),
+    (5, "requirement status, stale tests and change log", _add_requirement_lifecycle),
+    (6, "requirement spec references and section paths", _add_spec_refs),
+    (7, "full-text search over requirements and test cases", _add_search_index),
+    (8, "near-duplicate requirement clusters", _add_near_duplicates),
+]
+
+
+def current_version(conn):
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at REAL
+    )""")
+    conn.commit()
+    return conn.execute("SELECT COALESCE(MAX(version), 0) FROM schema_version").fetchone()[0]
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations up to `target` (default: all); returns the resulting version."""
+    version = current_version(conn)
+    # Table rebuilds must not cascade or be checked mid-copy; the pragma is a
+    # no-op inside a transaction, so set it before each step begins.
+    fk = conn.execute("PRAGMA foreign_keys").fetchone()[0]
+    conn.execute("PRAGMA foreign_keys=OFF")
+    try:
+        for v, description, step in MIGRATIONS:
+            if v <= version or (target is not None and v > target):
+                continue
+            cur = conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated while we waited for the lock.
+                if cur.execute("SELECT 1 FROM schema_version WHERE version = ?", (v,)).fetchone():
+                    conn.rollback()
+                    version = v
+                    continue
+                step(cur)
+                cur.execute("INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                            (v, description, time.time()))
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            version = v
+    finally:
+        conn.execute(f"PRAGMA foreign_keys={'ON' if fk else 'OFF'}")
+    return version
@@ -10,7 +10,21 @@ class ProjectCreate(BaseModel):
 class IngestResponse(BaseModel):
     project_id: int
     ingested: int
+    new: int = 0
+    existing: int = 0
     requirements: List[dict]
+    changes: Optional[dict] = None  # mode=diff only
+    ledger_pending_id: Optional[str] = None
+
+class BatchIngestResponse(BaseModel):
+    project_id: int
+    documents: List[dict]  # name and segment count per parsed document / archive member
+    skipped: List[str]
+    ingested: int
+    new: int = 0
+    existing: int = 0
+    requirements: List[dict]
+    ledger_pending_id: Optional[str] = None
 
 class TestCaseOut(BaseModel):
     test_id: int
@@ -19,3 +33,4 @@ class TestCaseOut(BaseModel):
     steps: List[str]
     compliance_justification: List[dict]
     risk_score: float
+    stale: bool = False
@@ -0,0 +1,175 @@
+# neardup.py
+"""
+Near-duplicate requirement detection: 5-byte shingles, MinHash
+signatures and LSH banding.
+
+Specs often restate a requirement with small wording changes. Each
+requirement gets a MinHash signature of its 5-byte shingles (word
+shingles are too coarse for one-sentence requirements: a single changed
+word removes most of them): NUM_PERM 32-bit values whose fraction of
+matches estimates the Jaccard similarity of two shingle sets. The
+signature is cut into BANDS bands of ROWS values and each band hashed to
+a bucket; requirements sharing a bucket are candidates, and a candidate
+whose estimated similarity is at least the threshold is a near duplicate.
+With 16 bands of 4 rows, pairs at similarity 0.7 become candidates 99% of
+the time and pairs below 0.3 almost never.
+
+Clusters are assigned as requirements are ingested: a new requirement
+joins the cluster of its most similar near duplicate, otherwise it starts
+its own. cluster_id is the id of the requirement that started it.
+
+Signatures are stored, so the permutations are fixed (seeded) and changing
+NUM_PERM, BANDS or ROWS needs a migration that recomputes them. NumPy is
+used when installed; the pure Python path gives identical signatures.
+"""
+import array
+import hashlib
+import random
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from ingest import normalize
+
+SHINGLE = 5  # bytes per shingle
+NUM_PERM = 64
+BANDS, ROWS = 16, 4  # BANDS * ROWS == NUM_PERM
+THRESHOLD = 0.7  # default estimated Jaccard similarity for a near duplicate
+MAX_CANDIDATES = 256  # per requirement; caps the cost of very common buckets
+_BLOCK = 4096  # shingles hashed at once by the NumPy path (2 MB of scratch)
+
+_MASK = (1 << 64) - 1
+_GOLDEN = 0x9E3779B97F4A7C15
+# Permutation i is the multiply-shift hash ((a_i * x + b_i) mod 2**64) >> 32
+# with odd a_i: no modulo, and uint64 arithmetic in NumPy wraps the same way.
+_rnd = random.Random(20240601)
+_A = [_rnd.randrange(1 << 64) | 1 for _ in range(NUM_PERM)]
+_B = [_rnd.randrange(1 << 64) for _ in range(NUM_PERM)]
+_PERMS = list(zip(_A, _B))
+if np is not None:
+    _NA = np.array(_A, dtype=np.uint64)[:, None]
+    _NB = np.array(_B, dtype=np.uint64)[:, None]
+
+
+def _mix(x):
+    """Spread a 40-bit shingle over 32 bits (Fibonacci hashing)."""
+    return ((x * _GOLDEN) & _MASK) >> 32
+
+
+def shingles(text, k=SHINGLE):
+    """Hashes of every k-byte window of the normalized UTF-8 text (the whole text if it is shorter)."""
+    data = normalize(text).encode("utf-8")
+    return {_mix(int.from_bytes(data[i:i + k], "little")) for i in range(max(len(data) - k + 1, 1))}
+
+
+def _np_shingles(data, k=SHINGLE):
+    """shingles() of UTF-8 bytes as a uint64 array, computed without a Python loop (may repeat values)."""
+    data = np.frombuffer(data, dtype=np.uint8).astype(np.uint64)
+    n = max(len(data) - k + 1, 1)
+    x = np.zeros(n, dtype=np.uint64)
+    for j in range(min(k, len(data))):
+        x |= data[j:j + n] << np.uint64(8 * j)
+    return (x * np.uint64(_GOLDEN)) >> np.uint64(32)
+
+
+def signature(text):
+    """MinHash signature of `text`: NUM_PERM little-endian uint32 values as bytes."""
+    if np is not None:
+        # Shingles are hashed a block at a time (windows overlap by k - 1
+        # bytes), so scratch memory is a few MB however long the segment is.
+        data = normalize(text).encode("utf-8")
+        sig = None
+        for i in range(0, max(len(data) - SHINGLE + 1, 1), _BLOCK):
+            x = _np_shingles(data[i:i + _BLOCK + SHINGLE - 1])
+            m = ((_NA * x + _NB) >> np.uint64(32)).min(axis=1)
+            sig = m if sig is None else np.minimum(sig, m)
+        return sig.astype("<u4").tobytes()
+    hs = shingles(text)
+    sig = array.array("I", [min([((a * x + b) & _MASK) >> 32 for x in hs]) for a, b in _PERMS])
+    if sys.byteorder != "little":
+        sig.byteswap()
+    return sig.tobytes()
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    if np is not None:
+        return float(np.count_nonzero(np.frombuffer(sig_a, "<u4") == np.frombuffer(sig_b, "<u4"))) / NUM_PERM
+    return sum(a == b for a, b in zip(array.array("I", sig_a), array.array("I", sig_b))) / NUM_PERM
+
+
+def buckets(sig):
+    """One signed 64-bit bucket key per band (the band number is part of the key)."""
+    step = ROWS * 4
+    return [int.from_bytes(hashlib.blake2b(sig[i:i + step], digest_size=8, salt=bytes([b])).digest(),
+                           "little", signed=True)
+            for b, i in enumerate(range(0, BANDS * step, step))]
+
+
+def assign_clusters(cur, project_id, items, threshold=THRESHOLD):
+    """
+    Sign and cluster new requirements. items: [(requirement_id, text)] not
+    yet clustered, in id order. Candidates come from the project's stored
+    buckets and from earlier items; stores each signature, cluster and the
+    similarity that put it there. Caller holds the write transaction.
+    Returns [(requirement_id, cluster_id, similarity or None)].
+    """
+    local_buckets, local = {}, {}  # this batch: bucket -> [id], id -> (signature, cluster_id)
+    out, lsh_rows = [], []
+    for rid, text in items:
+        sig = signature(text)
+        keys = buckets(sig)
+        found = set(r for (r,) in cur.execute(
+            f"""SELECT requirement_id FROM requirement_lsh
+                WHERE project_id = ? AND bucket IN ({','.join('?' * len(keys))}) LIMIT {MAX_CANDIDATES}""",
+            (project_id, *keys)))
+        for k in keys:
+            found.update(local_buckets.get(k, ()))
+        stored = [r for r in found if r not in local]
+        cands = [(r,) + local[r] for r in found if r in local]
+        if stored:
+            cands += cur.execute(f"SELECT id, minhash, COALESCE(cluster_id, id) FROM requirements WHERE id IN ({','.join('?' * len(stored))})",
+                                 stored).fetchall()
+        best = None
+        for _, csig, cluster in cands:
+            if csig is None:
+                continue
+            s = similarity(sig, csig)
+            if s >= threshold and (best is None or s > best[1] or (s == best[1] and cluster < best[0])):
+                best = (cluster, s)
+        cluster, sim = best if best else (rid, None)
+        local[rid] = (sig, cluster)
+        for k in keys:
+            local_buckets.setdefault(k, []).append(rid)
+            lsh_rows.append((project_id, k, rid))
+        out.append((rid, cluster, sim))
+    cur.executemany("UPDATE requirements SET minhash = ?, cluster_id = ?, cluster_similarity = ? WHERE id = ?",
+                    [(local[rid][0], cluster, sim, rid) for rid, cluster, sim in out])
+    cur.executemany("INSERT OR IGNORE INTO requirement_lsh (project_id, bucket, requirement_id) VALUES (?, ?, ?)", lsh_rows)
+    return out
+
+
+def clusters(conn, project_id, min_size=2, limit=50):
+    """
+    The project's largest clusters of active requirements (at least
+    `min_size` members), each with its members in id order, and how many
+    such clusters there are in total.
+    """
+    rows = conn.execute("""
+        SELECT cluster_id, COUNT(*) AS n FROM requirements
+        WHERE project_id = ? AND status = 'active' AND cluster_id IS NOT NULL
+        GROUP BY cluster_id HAVING n >= ? ORDER BY n DESC, cluster_id""", (project_id, min_size)).fetchall()
+    top = rows[:limit]
+    members = {}
+    for i in range(0, len(top), 500):
+        part = [c for c, _ in top[i:i + 500]]
+        for rid, cluster, text, sim, ref in conn.execute(f"""
+                SELECT id, cluster_id, text, cluster_similarity, spec_ref FROM requirements
+                WHERE project_id = ? AND status = 'active' AND cluster_id IN ({','.join('?' * len(part))})
+                ORDER BY id""", (project_id, *part)):
+            members.setdefault(cluster, []).append(
+                {"requirement_id": rid, "text": text, "similarity": sim, "spec_ref": ref})
+    return [{"cluster_id": c, "size": n, "requirements": members[c]} for c, n in top], len(rows)
@@ -0,0 +1,35 @@
+# tests/test_db_pool.py
+"""ConnectionPool: per-thread connections are closed when their thread exits."""
+import threading
+
+import db
+
+
+def test_thread_connections_closed_on_exit(tmp_path):
+    pool = db.ConnectionPool()
+    path = str(tmp_path / "pool.db")
+
+    def work():
+        with pool.connect(path) as conn:
+            conn.execute("SELECT 1")
+
+    for _ in range(50):
+        t = threading.Thread(target=work)
+        t.start()
+        t.join()
+    stats = pool.stats()
+    assert stats["opened"] == 50
+    assert stats["closed"] == 50
+    assert stats["open_connections"] == 0
+
+
+def test_close_all(tmp_path):
+    pool = db.ConnectionPool()
+    path = str(tmp_path / "pool.db")
+    with pool.connect(path) as conn:
+        conn.execute("SELECT 1")
+    assert pool.stats()["open_connections"] == 1
+    pool.close_all()
+    assert pool.stats()["open_connections"] == 0
+    with pool.connect(path) as conn:  # reopened on next use
+        assert conn.execute("SELECT 1").fetchone() == (1,)
@@ -0,0 +1,43 @@
+# tests/test_ingest_limits.py
+"""parse_documents(): request-wide limits on bytes, segments and members."""
+import io
+import zipfile
+
+import pytest
+
+import ingest
+
+
+def _zip(members):
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name, text in members:
+            zf.writestr(name, text)
+    buf.seek(0)
+    return buf
+
+
+def test_within_limits():
+    docs, skipped = ingest.parse_documents([("a.zip", _zip([("x.txt", "one\n\ntwo"), ("y.bin", "?")]))])
+    assert [(n, [s.text for s in segs]) for n, segs in docs] == [("a.zip/x.txt", ["one", "two"])]
+    assert skipped == ["a.zip/y.bin"]
+
+
+def test_total_bytes(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_TOTAL_BYTES", 1000)
+    files = [(f"{i}.txt", io.BytesIO(b"x" * 300)) for i in range(4)]
+    with pytest.raises(ValueError, match="bytes"):
+        ingest.parse_documents(files)
+
+
+def test_total_segments(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_SEGMENTS", 10)
+    files = [(f"{i}.txt", io.BytesIO(b"a\n\nb\n\nc\n\nd")) for i in range(3)]
+    with pytest.raises(ValueError, match="segments"):
+        ingest.parse_documents(files)
+
+
+def test_total_members(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_MEMBERS", 5)
+    with pytest.raises(ValueError, match="members"):
+        ingest.parse_documents([("a.zip", _zip([(f"{i}.bin", "") for i in range(6)]))])
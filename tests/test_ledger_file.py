@@ -0,0 +1,105 @@
+# tests/test_ledger_file.py
+"""FileLedger crash recovery: torn tails, stale index points, reader locks."""
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from ledger_file import FileLedger, _INDEX
+
+
+def _append(led, n, start=0):
+    return [led.append({"action": "ingest", "project_id": 1, "count": i}) for i in range(start, start + n)]
+
+
+def _assert_intact(led, n):
+    assert led.verify() == {"ok": True, "from_idx": 0, "to_idx": n, "checked": n}
+    assert [e["idx"] for e in led.iter_entries()] == list(range(1, n + 1))
+
+
+def test_torn_tail_is_dropped_and_log_keeps_growing(tmp_path):
+    path = str(tmp_path / "ledger.log")
+    led = FileLedger(path, index_every=4)
+    _append(led, 10)
+    led.close()
+    with open(path, "ab") as f:
+        f.write(b"\x17" * 40)  # a record cut short by a crash
+    led = FileLedger(path, index_every=4)
+    _assert_intact(led, 10)
+    _append(led, 15, start=10)
+    led.close()
+    led = FileLedger(path, index_every=4)
+    _assert_intact(led, 25)
+    assert [e["idx"] for e in led.read_latest(limit=3, before_idx=20)] == [19, 18, 17]
+    led.close()
+
+
+def test_partially_written_last_record_is_dropped(tmp_path):
+    path = str(tmp_path / "ledger.log")
+    led = FileLedger(path, index_every=4)
+    _append(led, 9)
+    led.close()
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+    led = FileLedger(path, index_every=4)
+    _assert_intact(led, 8)
+    _append(led, 1)
+    _assert_intact(led, 9)
+    led.close()
+
+
+def test_stale_index_points_are_discarded(tmp_path):
+    path = str(tmp_path / "ledger.log")
+    led = FileLedger(path, index_every=4)
+    _append(led, 10)
+    led.close()
+    # An index point for bytes lost in a crash, which the log has since grown past.
+    with open(path + ".idx", "ab") as f:
+        f.write(_INDEX.pack(11, os.path.getsize(path) + 10))
+    led = FileLedger(path, index_every=4)
+    _append(led, 10, start=10)
+    led.close()
+    led = FileLedger(path, index_every=4)
+    _assert_intact(led, 20)
+    with open(path + ".idx", "rb") as f:
+        points = list(_INDEX.iter_unpack(f.read()))
+    assert all(led._record_idx_at(off) == idx for idx, off in points)
+    led.close()
+
+
+def test_reader_does_not_release_writer_lock(tmp_path):
+    path = str(tmp_path / "ledger.log")
+    led = FileLedger(path)
+    _append(led, 3)
+    probe = ("import fcntl, os, sys\n"
+             "fd = os.open(sys.argv[1], os.O_RDONLY)\n"
+             "try:\n"
+             "    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)\n"
+             "    print('acquired')\n"
+             "except BlockingIOError:\n"
+             "    print('blocked')\n")
+    with led._lock, led._file_lock():
+        reader = threading.Thread(target=led.read_latest)
+        reader.start()
+        reader.join(0.2)  # blocks on the shared lock until the writer is done
+        out = subprocess.run([sys.executable, "-c", probe, path], capture_output=True, text=True).stdout
+    reader.join()
+    assert out.strip() == "blocked"
+    led.close()
+
+
+def test_interval_policy_syncs_in_background(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: (synced.append(fd), real_fsync(fd)))
+    led = FileLedger(str(tmp_path / "ledger.log"), fsync="interval", fsync_interval=0.05)
+    led._last_fsync = float("inf")  # keep append_many from syncing itself
+    _append(led, 3)
+    assert synced == []
+    deadline = time.monotonic() + 5
+    while not synced and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert synced == [led._fd]
+    led.close()
+    assert not led._flusher.is_alive()
@@ -0,0 +1,48 @@
+# tests/test_merkle.py
+"""Ledger Merkle roots and inclusion proofs against a naively built tree."""
+import pytest
+
+import db
+from ledger import Ledger, _merkle_leaf, _merkle_node
+
+
+def naive_root(entry_hashes):
+    """Pair nodes level by level; an odd last node is carried up unchanged."""
+    level = [_merkle_leaf(h) for h in entry_hashes]
+    while len(level) > 1:
+        level = [_merkle_node(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+    return level[0]
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    # A small epoch makes the index grow incrementally across many syncs.
+    led = Ledger(str(tmp_path / "ledger.db"), merkle_epoch=3)
+    yield led
+    db.pool.close_all()
+
+
+def test_roots_and_proofs_match_naive_tree(ledger):
+    hashes = []
+    for n in range(1, 34):
+        hashes.append(ledger.append({"action": "ingest", "project_id": n % 4, "count": n}))
+        root = ledger.merkle_root()
+        assert root["tree_size"] == n
+        assert root["root"] == naive_root(hashes)
+        for idx in range(1, n + 1):
+            p = ledger.merkle_proof(idx)
+            assert p["hash"] == hashes[idx - 1]
+            assert p["root"] == root["root"]
+            assert Ledger.verify_inclusion(p["hash"], p["proof"], p["root"])
+
+
+def test_proof_rejects_other_entries_and_roots(ledger):
+    hashes = [ledger.append({"action": "ingest", "project_id": 1, "count": i}) for i in range(11)]
+    p = ledger.merkle_proof(6)
+    assert not Ledger.verify_inclusion(hashes[6], p["proof"], p["root"])
+    assert not Ledger.verify_inclusion(p["hash"], p["proof"], naive_root(hashes[:10]))
+    tampered = [dict(step, hash=_merkle_leaf(step["hash"])) if i == 0 else step for i, step in enumerate(p["proof"])]
+    assert not Ledger.verify_inclusion(p["hash"], tampered, p["root"])
+    assert ledger.merkle_proof(0) is None
+    assert ledger.merkle_proof(12) is None
@@ -0,0 +1,60 @@
+# tests/test_snapshots.py
+"""Ledger state snapshots: stored, pruned, and equal to a replay from genesis."""
+import sqlite3
+
+import pytest
+
+import db
+from ledger import Ledger
+
+
+def _events(n):
+    for i in range(n):
+        if i % 5 == 4:
+            yield {"action": "approve_test", "project_id": i % 3, "test_id": i}
+        elif i % 5 == 3:
+            yield {"action": "generate", "project_id": i % 3}
+        else:
+            yield {"action": "ingest", "project_id": i % 3, "count": i}
+
+
+def _from_genesis(path):
+    """project_state() computed by a ledger that has no snapshots to start from."""
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM ledger_snapshot_projects")
+    conn.execute("DELETE FROM ledger_snapshots")
+    conn.commit()
+    conn.close()
+    return Ledger(path).project_state()
+
+
+@pytest.fixture
+def path(tmp_path):
+    yield str(tmp_path / "ledger.db")
+    db.pool.close_all()
+
+
+def test_snapshot_on_fresh_ledger_is_stored(path):
+    led = Ledger(path)
+    for e in _events(7):
+        led.append(e)
+    assert led.snapshot() == 7
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT idx FROM ledger_snapshots").fetchall() == [(7,)]
+    assert conn.execute("SELECT COUNT(*) FROM ledger_snapshot_projects WHERE idx = 7").fetchone()[0] == 3
+    conn.close()
+
+
+def test_state_matches_replay_from_genesis(path):
+    led = Ledger(path, snapshot_every=10, snapshot_keep=2)
+    for e in _events(57):
+        led.append(e)
+    conn = sqlite3.connect(path)
+    assert [i for (i,) in conn.execute("SELECT idx FROM ledger_snapshots ORDER BY idx")] == [40, 50]
+    assert conn.execute("SELECT COUNT(DISTINCT idx) FROM ledger_snapshot_projects").fetchone()[0] == 2
+    conn.close()
+    state = led.project_state()
+    one = led.project_state(1)
+    assert state["as_of_idx"] == 57
+    assert one["state"] == state["state"]["1"]
+    assert state == _from_genesis(path)